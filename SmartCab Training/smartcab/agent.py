@@ -1,21 +1,35 @@
+import os
+import json
 import random
 import math
+import argparse
+import numpy as np
 from environment import Agent, Environment
 from planner import RoutePlanner
 from simulator import Simulator
+from qtable import StateEncoder, save_qtable, load_qtable
+from replay import ReplayBuffer, batch_update
+from output import console, QUIET, RUN, TRIAL, STEP
 
 class LearningAgent(Agent):
     """ An agent that learns to drive in the Smartcab world.
         This is the object you will be modifying. """ 
 
-    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5):
+    def __init__(self, env, learning=False, epsilon=1.0, alpha=0.5, constant_a=0.995, tolerance=0.3688, replay=0, batch_size=32, share_Q_with=None):
         super(LearningAgent, self).__init__(env)     # Set the agent in the evironment 
         self.planner = RoutePlanner(self.env, self)  # Create a route planner
         self.valid_actions = self.env.valid_actions  # The set of valid actions
 
         # Set parameters of the learning agent
         self.learning = learning # Whether the agent is expected to learn
-        self.Q = {}              # Create a Q-table which will be a dictionary of tuples
+        self.encoder = StateEncoder([self.valid_actions, ['green', 'red'], self.valid_actions]) # Dense codes of (waypoint, light, oncoming)
+        self.action_index = dict((action, i) for i, action in enumerate(self.valid_actions))
+        if share_Q_with is not None: # Learn into the Q-table of another LearningAgent
+            self.Q = share_Q_with.Q
+            self.Q_created = share_Q_with.Q_created
+        else:
+            self.Q = np.zeros((self.encoder.n_states, len(self.valid_actions))) # Create a Q-table with a row of action values per state code
+            self.Q_created = np.zeros(self.encoder.n_states, dtype=bool)       # Whether each state has been created in the Q-table
         self.epsilon = epsilon   # Random exploration factor
         self.alpha = alpha       # Learning factor
 
@@ -24,8 +38,12 @@ class LearningAgent(Agent):
         ###########
         # Set any additional class parameters as needed
         self.x = 1 #need to make an initial x for decaying the epsilon
-        self.constant_a = 0.995 # constant value set up for decay function
-        self.tolerance = 0.3688
+        self.constant_a = constant_a # constant value set up for decay function
+        self.tolerance = tolerance
+
+        # Experience replay: learn from minibatches of the last 'replay' transitions instead of each step once
+        self.replay = ReplayBuffer(replay) if replay else None
+        self.batch_size = batch_size
         
                         
     def reset(self, destination=None, testing=False):
@@ -58,7 +76,7 @@ class LearningAgent(Agent):
             self.epsilon = 0.0
             self.alpha = 0.0
 
-        print "x =", self.x
+        console.log(TRIAL, "x = {}", self.x)
         self.x += 1
         
         return
@@ -96,7 +114,7 @@ class LearningAgent(Agent):
         ###########
         # Calculate the maximum Q-value of all actions for a given state
         
-        maxQ = self.Q[str(state)].values()
+        maxQ = self.Q[self.encoder.encode(state)]
                 
         return maxQ
 
@@ -111,20 +129,9 @@ class LearningAgent(Agent):
         # If it is not, create a new dictionary for that state
         #   Then, for each action available, set the initial Q-value to 0.0
 
-        if self.learning == False:
-            self.Q = None
-        
-        else:
-            if str(state) in self.Q:
-                self.Q = self.Q
-            else:
-                self.Q[str(state)] = {}
-                #self.Q[str(state)] = {'action':'Qvalue'}
-                for x in range(len(self.valid_actions)):
-                    self.Q[str(state)].update({str(self.valid_actions[x]):0.0})
-
-        #print "self.Q =", self.Q
-        #print "self.Q[state] ", self.Q[str(state)] 
+        if self.learning == True:
+            # Q-values of every state start at 0.0; mark the state as created
+            self.Q_created[self.encoder.encode(state)] = True
 
         return 
 
@@ -151,26 +158,23 @@ class LearningAgent(Agent):
         else:
             if random.uniform(self.tolerance, 1.0) < self.epsilon:
                 action = self.valid_actions[random.randint(0, 3)]
-                print "random used =", action
+                console.log(STEP, "random used = {}", action)
             else:
                 QV = self.get_maxQ(state)
-                print "QV List =", QV 
-                mQ = max(QV)
-                print "max value =", mQ
-                count = QV.count(mQ)
-                print "count =", count
+                console.log(STEP, "QV List = {}", QV)
+                i = QV.argmax()
+                mQ = QV[i]
+                console.log(STEP, "max value = {!s}", mQ)
+                best = (QV == mQ).nonzero()[0]
+                count = len(best)
+                console.log(STEP, "count = {}", count)
                 if count > 1:
-                    best = [i for i in range(len(QV)) if QV[i] == mQ]
                     i = random.choice(best)
-                    print "random MaxQ Used =", self.env.valid_actions[i]
-                    action = self.env.valid_actions[i]
-                    action = None if action == 'None' else action
-                else:
-                    action = max(self.Q[str(state)], key=self.Q[str(state)].get)
-                    action = None if action == 'None' else action
+                    console.log(STEP, "random MaxQ Used = {}", self.valid_actions[i])
+                action = self.valid_actions[i]
                         
-        print "state = ", state               
-        print "action =", action
+        console.log(STEP, "state =  {}", state)
+        console.log(STEP, "action = {}", action)
         
         return action
 
@@ -185,15 +189,34 @@ class LearningAgent(Agent):
         # When learning, implement the value iteration update rule
         #   Use only the learning rate 'alpha' (do not use the discount factor 'gamma')
 
-        if self.learning == False:
-            self.Q = self.Q
-        else:
-            self.Qvalue = ((1-self.alpha) * self.Q[str(state)][str(action)] + (reward*self.alpha))
-            self.Q[str(state)][str(action)] = self.Qvalue
+        if self.learning == True:
+            s = self.encoder.encode(state)
+            a = self.action_index[action]
+            if self.replay is not None: # Store the transition, then update from a minibatch of stored ones
+                self.replay.add(s, a, reward)
+                states, actions, rewards = self.replay.sample(self.batch_size)
+                batch_update(self.Q, states, actions, rewards, self.alpha)
+            else:
+                self.Qvalue = ((1-self.alpha) * self.Q[s, a] + (reward*self.alpha))
+                self.Q[s, a] = self.Qvalue
         
         return 
 
 
+    def save_Q(self, filename):
+        """ Save the Q-table to a binary .npy file that load_Q can read back. """
+
+        save_qtable(filename, self.encoder, self.Q, self.Q_created)
+
+
+    def load_Q(self, filename):
+        """ Warm-start the Q-table from a file written by save_Q. """
+
+        codes, table = load_qtable(filename, self.encoder)
+        self.Q[codes] = table['Q']
+        self.Q_created[codes] = table['created']
+
+
     def update(self):
         """ The update function is called when a time step is completed in the 
             environment for a given trial. This function will build the agent
@@ -208,9 +231,89 @@ class LearningAgent(Agent):
         return 
         
 
-def run():
+def parse_args(argv=None):
+    """ The settings of run() from the command line 'argv' (default: sys.argv). The
+        defaults are those of the improved Q-learner. Settings that training with
+        several workers cannot honour are rejected together with --workers. """
+
+    parser = argparse.ArgumentParser(description="Train and test a LearningAgent in the smartcab world.")
+    parser.add_argument('--grid-size', type=int, nargs=2, default=[8, 6], metavar=('COLUMNS', 'ROWS'), help="intersections of the grid")
+    parser.add_argument('--num-dummies', type=int, default=100, help="dummy agents in the environment")
+    parser.add_argument('--traffic-engine', action='store_true', help="update all dummy agents in one NumPy pass per step")
+    parser.add_argument('--routing-table', action='store_true', help="look up waypoints, distances and trips in precomputed tables")
+    parser.add_argument('--epsilon', type=float, default=None, help="initial exploration factor (default: 0.995)")
+    parser.add_argument('--alpha', type=float, default=0.25, help="learning rate")
+    parser.add_argument('--constant-a', type=float, default=0.995, help="base of the epsilon decay function")
+    parser.add_argument('--tolerance', type=float, default=0.3688, help="epsilon below which testing begins")
+    parser.add_argument('--replay', type=int, default=0, help="size of the experience replay buffer (default: no replay)")
+    parser.add_argument('--batch-size', type=int, default=32, help="transitions replayed per step")
+    parser.add_argument('--learners', type=int, default=0, help="additional learning agents sharing the Q-table")
+    parser.add_argument('--seed', type=int, default=None, help="seed of the random number generators (default: unseeded)")
+    parser.add_argument('--min-train', type=int, default=20, help="minimum number of training trials")
+    parser.add_argument('--n-test', type=int, default=30, help="number of testing trials")
+    parser.add_argument('--display', action='store_true', help="show the simulation in a PyGame window")
+    parser.add_argument('--update-delay', type=float, default=None, help="seconds between steps (default: 0.01)")
+    parser.add_argument('--fast', action='store_true', help="step as fast as possible, without GUI or per-step text")
+    parser.add_argument('--log-format', choices=['csv', 'npy'], default='csv', help="format of the trial log")
+    parser.add_argument('--verbosity', choices=['quiet', 'run', 'trial', 'step'], default=None,
+                        help="terminal output (default: step, or run with --bench)")
+    parser.add_argument('--quiet', action='store_true', help="no terminal output, same as --verbosity quiet")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="processes training one shared Q-table, always headless and fast (see hogwild.py)")
+    parser.add_argument('--bench', action='store_true', help="run fast and print the throughput as JSON at the end")
+    args = parser.parse_args(argv)
+
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.workers > 1:
+        # Workers are headless, follow the coordinator's decay schedule and have no learners
+        for flag, used in [('--epsilon', args.epsilon is not None), ('--learners', args.learners > 0),
+                           ('--display', args.display), ('--update-delay', args.update_delay is not None)]:
+            if used:
+                parser.error("{} cannot be used with --workers".format(flag))
+    if args.epsilon is None:
+        args.epsilon = 0.995
+    if args.update_delay is None:
+        args.update_delay = 0.01
+    return args
+
+
+def run(argv=None):
     """ Driving function for running the simulation. 
-        Press ESC to close the simulation, or [SPACE] to pause the simulation. """
+        Press ESC to close the simulation, or [SPACE] to pause the simulation.
+        The settings come from the command line, see parse_args or run with --help. """
+
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+
+    ##############
+    # Terminal output
+    # Levels: QUIET (none), RUN (start and end of the run), TRIAL (each trial), STEP (every step, default)
+    levels = {'quiet': QUIET, 'run': RUN, 'trial': TRIAL, 'step': STEP}
+    if args.quiet:
+        console.set_level(QUIET)
+    elif args.verbosity is not None:
+        console.set_level(levels[args.verbosity])
+    else:
+        console.set_level(RUN if args.bench else STEP)
+
+    ##############
+    # Train with several processes sharing one Q-table
+    # (logged to the files of the Simulator's improved learner)
+    if args.workers > 1:
+        from hogwild import train
+        result = train(workers=args.workers, seed=args.seed, alpha=args.alpha, constant_a=args.constant_a,
+                       tolerance=args.tolerance, min_train=args.min_train, n_test=args.n_test,
+                       env_kwargs={'num_dummies': args.num_dummies, 'grid_size': tuple(args.grid_size),
+                                   'traffic_engine': args.traffic_engine, 'routing_table': args.routing_table},
+                       agent_kwargs={'replay': args.replay, 'batch_size': args.batch_size},
+                       log_filename=os.path.join("logs", "sim_improved-learning." + args.log_format), log_format=args.log_format,
+                       Q_filename=os.path.join("logs", "sim_improved-learning_Q.npy"))
+        if args.bench:
+            print json.dumps(result['throughput'], sort_keys=True)
+        return
 
     ##############
     # Create the environment
@@ -218,7 +321,10 @@ def run():
     #   verbose     - set to True to display additional output from the simulation
     #   num_dummies - discrete number of dummy agents in the environment, default is 100
     #   grid_size   - discrete number of intersections (columns, rows), default is (8, 6)
-    env = Environment(num_dummies=100)
+    #   routing_table - set to True to look up waypoints, distances and trips in precomputed tables
+    #   traffic_engine - set to True to update all dummy agents in one NumPy pass per step
+    env = Environment(num_dummies=args.num_dummies, grid_size=tuple(args.grid_size),
+                      routing_table=args.routing_table, traffic_engine=args.traffic_engine)
     
     ##############
     # Create the driving agent
@@ -226,7 +332,21 @@ def run():
     #   learning   - set to True to force the driving agent to use Q-learning
     #    * epsilon - continuous value for the exploration factor, default is 1
     #    * alpha   - continuous value for the learning rate, default is 0.5
-    agent = env.create_agent(LearningAgent, learning=True, epsilon=0.995, alpha=0.25)
+    #    * constant_a - base of the epsilon decay function, default is 0.995
+    #    * tolerance  - lower bound of the exploration draw, default is 0.3688
+    #    * replay     - size of the experience replay buffer, default is 0 (learn from each step once)
+    #    * batch_size - transitions replayed per step when 'replay' is set, default is 32
+    #    * share_Q_with - another LearningAgent whose Q-table to learn into, default is a Q-table of its own
+    agent_kwargs = dict(learning=True, epsilon=args.epsilon, alpha=args.alpha, constant_a=args.constant_a,
+                        tolerance=args.tolerance, replay=args.replay, batch_size=args.batch_size)
+    agent = env.create_agent(LearningAgent, **agent_kwargs)
+    # To test a saved policy without training it again, create the agent with
+    # epsilon=0.0, warm-start it with agent.load_Q("logs/sim_improved-learning_Q.npy")
+    # and run the simulator with min_train=0
+
+    # Additional learners drive trips of their own and learn into the same Q-table
+    for i in xrange(args.learners):
+        env.add_learner(env.create_agent(LearningAgent, share_Q_with=agent, **agent_kwargs))
     
     ##############
     # Follow the driving agent
@@ -239,16 +359,31 @@ def run():
     # Flags:
     #   update_delay - continuous time (in seconds) between actions, default is 2.0 seconds
     #   display      - set to False to disable the GUI if PyGame is enabled
-    #   log_metrics  - set to True to log trial and simulation results to /logs
+    #   log_metrics  - set to True to log trial and simulation results to /logs (learners to a separate _learners log)
     #   optimized    - set to True to change the default log file name
-    sim = Simulator(env, update_delay=0.01, display=False, log_metrics=True, optimized=True)
+    #   fast         - set to True to step as fast as possible, without GUI or per-step text
+    #   log_format   - 'csv' (default) or 'npy' for a typed, memory-mappable trial log
+    #   trace        - file to record every step of the primary agent to, for replay with steptrace.TraceReplay
+    #   checkpoint   - file to checkpoint the run to, every 'checkpoint_every' trials (default 100)
+    #   resume       - set to True to continue the run from 'checkpoint' if it exists
+    #   record       - directory (PNG sequence) or .npz archive to record rendered frames to, also without display
+    #   record_trials - set of trials to record (counted over the whole run), default is all
+    #   frame_skip   - number of steps skipped between recorded frames, default is 0
+    #   profile      - set to True to time each phase of a step, reported at the end and logged per trial
+    fast = args.fast or args.bench
+    sim = Simulator(env, update_delay=args.update_delay, display=args.display and not fast, log_metrics=True, optimized=True,
+                    fast=fast, log_format=args.log_format)
     
     ##############
     # Run the simulator
     # Flags:
     #   tolerance  - epsilon tolerance before beginning testing, default is 0.05 
     #   n_test     - discrete number of testing trials to perform, default is 0
-    sim.run(tolerance=0.3688, n_test=30)     
+    #   min_train  - minimum number of training trials, default is 20
+    sim.run(tolerance=args.tolerance, n_test=args.n_test, min_train=args.min_train)
+
+    if args.bench:
+        print json.dumps(sim.throughput, sort_keys=True)
 
 
 if __name__ == '__main__':
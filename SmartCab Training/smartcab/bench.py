@@ -0,0 +1,358 @@
+import os
+import sys
+import math
+import json
+import random
+import argparse
+import platform
+import multiprocessing
+import subprocess
+from contextlib import contextmanager
+from timeit import default_timer
+import numpy as np
+from environment import Environment
+from simulator import Simulator
+from agent import LearningAgent
+from qtable import StateEncoder
+from hogwild import train
+from output import console, QUIET
+
+
+def seed_all(seed):
+    """ Seed both random number generators, so each benchmark replays the same run. """
+
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+@contextmanager
+def quiet():
+    """ Turn off the terminal output of the simulation while timing it. """
+
+    level = console.level
+    console.set_level(QUIET)
+    try:
+        yield
+    finally:
+        console.set_level(level)
+
+
+def make_env(num_dummies=100, grid_size=(8, 6), **kwargs):
+    """ An Environment with a learning primary agent, as in agent.run. """
+
+    env = Environment(num_dummies=num_dummies, grid_size=grid_size, **kwargs)
+    agent = env.create_agent(LearningAgent, learning=True, epsilon=0.995, alpha=0.25)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    return env
+
+
+def deep_sizeof(obj, seen=None):
+    """ Approximate memory footprint of 'obj' in bytes, following containers. """
+
+    seen = set() if seen is None else seen
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = obj.nbytes if isinstance(obj, np.ndarray) else sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in obj.iteritems())
+    elif isinstance(obj, (list, tuple, set)):
+        size += sum(deep_sizeof(item, seen) for item in obj)
+    return size
+
+
+class DictQ(object):
+    """ The string-keyed dict of dicts Q-table that LearningAgent used to keep. """
+
+    def __init__(self, valid_actions):
+        self.valid_actions = valid_actions
+        self.Q = {}
+
+    def step(self, state, reward, alpha):
+        if str(state) not in self.Q:
+            self.Q[str(state)] = {}
+            for x in range(len(self.valid_actions)):
+                self.Q[str(state)].update({str(self.valid_actions[x]): 0.0})
+        QV = self.Q[str(state)].values()
+        mQ = max(QV)
+        if QV.count(mQ) > 1:
+            action = self.valid_actions[random.choice([i for i in range(len(QV)) if QV[i] == mQ])]
+        else:
+            action = max(self.Q[str(state)], key=self.Q[str(state)].get)
+            action = None if action == 'None' else action
+        self.Q[str(state)][str(action)] = (1 - alpha) * self.Q[str(state)][str(action)] + reward * alpha
+
+
+class ArrayQ(object):
+    """ The integer-encoded, array-backed Q-table of LearningAgent. """
+
+    def __init__(self, valid_actions):
+        self.valid_actions = valid_actions
+        self.encoder = StateEncoder([valid_actions, ['green', 'red'], valid_actions])
+        self.action_index = dict((action, i) for i, action in enumerate(valid_actions))
+        self.Q = np.zeros((self.encoder.n_states, len(valid_actions)))
+        self.Q_created = np.zeros(self.encoder.n_states, dtype=bool)
+
+    def step(self, state, reward, alpha):
+        s = self.encoder.encode(state)
+        self.Q_created[s] = True
+        QV = self.Q[s]
+        i = QV.argmax()
+        best = (QV == QV[i]).nonzero()[0]
+        if len(best) > 1:
+            i = random.choice(best)
+        self.Q[s, i] = (1 - alpha) * self.Q[s, i] + reward * alpha
+
+
+def bench_qtable(n_steps=100000, seed=0):
+    """ Memory and per-step latency (create, argmax, update) of the dict and array Q-tables. """
+
+    random.seed(seed)
+    actions = Environment.valid_actions
+    states = [(random.choice(actions[1:]), random.choice(['green', 'red']), random.choice(actions)) for _ in xrange(n_steps)]
+    rewards = [random.uniform(-40, 2) for _ in xrange(n_steps)]
+
+    results = {}
+    for name, table in [('dict', DictQ(actions)), ('array', ArrayQ(actions))]:
+        start = default_timer()
+        for state, reward in zip(states, rewards):
+            table.step(state, reward, 0.25)
+        seconds = default_timer() - start
+        tables = [table.Q] if name == 'dict' else [table.Q, table.Q_created, table.encoder.index, table.encoder.states]
+        results[name] = {
+            'step_us': seconds * 1e6 / n_steps,
+            'table_bytes': deep_sizeof(tables[0]),
+            'total_bytes': deep_sizeof(tables)
+        }
+    return results
+
+
+construction_grids = [(8, 6), (50, 50), (100, 100), (250, 250), (500, 500), (1000, 1000)]
+
+
+def measure_construction(grid_size, num_dummies=100, n_resets=10, seed=0):
+    """ Time and peak memory growth of constructing an Environment of 'grid_size', and
+        the mean time of its reset. The memory reading is only meaningful in a fresh
+        process (see bench_construction). """
+
+    import resource  # Unix only
+    seed_all(seed)
+    scale = 1 if sys.platform == 'darwin' else 1024  # ru_maxrss is in bytes on macOS, KB on Linux
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    start = default_timer()
+    env = make_env(num_dummies, grid_size)
+    seconds = default_timer() - start
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+
+    with quiet():
+        start = default_timer()
+        for i in xrange(n_resets):
+            env.reset()
+        reset_seconds = (default_timer() - start) / n_resets
+
+    return {
+        'grid_size': list(grid_size),
+        'intersections': len(env.intersections),
+        'roads': len(env.roads),
+        'seconds': seconds,
+        'reset_seconds': reset_seconds,
+        'peak_bytes': after - before,
+        'road_bytes': env.roads.nbytes
+    }
+
+
+def bench_construction(grid_sizes=construction_grids, num_dummies=100, seed=0):
+    """ Construction and reset time and memory of Environments across 'grid_sizes', each
+        measured in its own process. """
+
+    results = []
+    for grid_size in grid_sizes:
+        output = subprocess.check_output([sys.executable, os.path.abspath(__file__), 'construct',
+                                          str(grid_size[0]), str(grid_size[1]), str(num_dummies), str(seed)])
+        results.append(json.loads(output))
+    return results
+
+
+step_dummies = [0, 10, 100, 1000, 10000]
+
+
+def step_grid(num_dummies):
+    """ The default grid for up to the default 100 dummies; for more, the smallest square
+        grid at which they take up at most half of the (intersection, heading) slots. """
+
+    if num_dummies <= 100:
+        return (8, 6)
+    side = int(math.ceil(math.sqrt(num_dummies / 2.0)))
+    return (side, side)
+
+
+def bench_step(dummy_counts=step_dummies, n_steps=200, min_steps=20, traffic_engine=False, seed=0):
+    """ Steps per second of Environment.step with each number of dummies in 'dummy_counts',
+        starting a new trial whenever one ends. Large counts are timed over fewer steps
+        (at least 'min_steps'), as their steps are slower. """
+
+    results = []
+    for num_dummies in dummy_counts:
+        seed_all(seed)
+        grid_size = step_grid(num_dummies)
+        env = make_env(num_dummies, grid_size, traffic_engine=traffic_engine)
+        steps = max(min_steps, min(n_steps, n_steps * 100 // max(1, num_dummies)))
+        with quiet():
+            env.reset()
+            start = default_timer()
+            for i in xrange(steps):
+                if env.done:
+                    env.reset()
+                env.step()
+            seconds = default_timer() - start
+        results.append({
+            'num_dummies': num_dummies,
+            'grid_size': list(grid_size),
+            'traffic_engine': traffic_engine,
+            'steps': steps,
+            'seconds': seconds,
+            'steps_per_sec': steps / seconds,
+            'step_us': seconds * 1e6 / steps
+        })
+    return results
+
+
+def bench_update(n_steps=2000, num_dummies=100, seed=0):
+    """ Latency of LearningAgent.update (sense, choose, act and learn) over 'n_steps' steps. """
+
+    seed_all(seed)
+    env = make_env(num_dummies)
+    agent = env.primary_agent
+    update = agent.update
+    latencies = []
+
+    def timed_update():
+        start = default_timer()
+        update()
+        latencies.append(default_timer() - start)
+
+    agent.update = timed_update
+    with quiet():
+        env.reset()
+        for i in xrange(n_steps):
+            if env.done:
+                env.reset()
+            env.step()
+
+    latencies = np.array(latencies) * 1e6
+    return {
+        'steps': n_steps,
+        'num_dummies': num_dummies,
+        'mean_us': latencies.mean(),
+        'p50_us': np.percentile(latencies, 50),
+        'p99_us': np.percentile(latencies, 99)
+    }
+
+
+def bench_run(n_trials=50, num_dummies=100, seed=0):
+    """ End-to-end throughput of a headless Simulator.run of 'n_trials' trials. """
+
+    seed_all(seed)
+    env = make_env(num_dummies)
+    sim = Simulator(env, update_delay=0.0, display=False, log_metrics=False, fast=True)
+    with quiet(): # run always ends with a testing trial, even with n_test=0
+        sim.run(tolerance=1.0, n_test=0, min_train=n_trials - 1)
+    return dict(sim.throughput, num_dummies=num_dummies)
+
+
+def worker_counts():
+    """ Powers of two up to the number of cores, and the number of cores. """
+
+    cores = multiprocessing.cpu_count()
+    return sorted(set([2 ** i for i in xrange(int(math.log(cores, 2)) + 1)] + [cores]))
+
+
+def bench_hogwild(workers=None, n_trials=100, seed=0):
+    """ Training throughput of hogwild.train with each number of worker processes in
+        'workers' (default: worker_counts), over 'n_trials' training trials each, and
+        its speedup over the first count. """
+
+    results = []
+    for n_workers in workers or worker_counts():
+        with quiet(): # exactly 'n_trials' training trials, then no testing
+            throughput = train(workers=n_workers, seed=seed, tolerance=1.0, min_train=n_trials, n_test=0)['throughput']
+        results.append(dict(throughput, speedup=throughput['transitions_per_sec'] / results[0]['transitions_per_sec'] if results else 1.0))
+    return results
+
+
+def run_suite(seed=0, quick=False, workers=None):
+    """ Run every benchmark with fixed seeds. Returns the results as a JSON-ready dict.
+        'quick' shortens the runs and skips the largest sizes, for smoke tests.
+        'workers' are the worker counts of the hogwild benchmark (see bench_hogwild). """
+
+    scale = 10 if quick else 1
+    return {
+        'meta': {
+            'seed': seed,
+            'quick': quick,
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cores': multiprocessing.cpu_count()
+        },
+        'qtable': bench_qtable(n_steps=100000 // scale, seed=seed),
+        'construction': bench_construction(construction_grids[:3] if quick else construction_grids, seed=seed),
+        'step': bench_step(step_dummies[:4] if quick else step_dummies, n_steps=200 // scale, min_steps=20 // scale, seed=seed),
+        'step_traffic_engine': bench_step(step_dummies[:4] if quick else step_dummies, n_steps=200 // scale, min_steps=20 // scale,
+                                          traffic_engine=True, seed=seed),
+        'update': bench_update(n_steps=2000 // scale, seed=seed),
+        'run': bench_run(n_trials=50 // scale, seed=seed),
+        'hogwild': bench_hogwild(workers, n_trials=100 // scale, seed=seed)
+    }
+
+
+def print_suite(results):
+    """ Print the results of run_suite as tables. """
+
+    for name, result in sorted(results['qtable'].items()):
+        print "{:>6} Q-table: {:6.2f} us/step, {:6d} bytes of values, {:6d} bytes with indexes".format(
+            name, result['step_us'], result['table_bytes'], result['total_bytes'])
+
+    print
+    for result in results['construction']:
+        print "{:>12} grid: {:8d} intersections, {:8d} roads, {:8.3f} s, {:10.1f} us/reset, {:8.1f} MB peak".format(
+            "x".join(str(n) for n in result['grid_size']), result['intersections'], result['roads'],
+            result['seconds'], result['reset_seconds'] * 1e6, result['peak_bytes'] / 2.0 ** 20)
+
+    for key in ['step', 'step_traffic_engine']:
+        print
+        for result in results[key]:
+            print "{:>6} dummies on {:>9}{}: {:10.1f} steps/sec, {:10.1f} us/step".format(
+                result['num_dummies'], "x".join(str(n) for n in result['grid_size']),
+                " (traffic engine)" if result['traffic_engine'] else "", result['steps_per_sec'], result['step_us'])
+
+    print
+    result = results['update']
+    print "LearningAgent.update: {:.1f} us mean, {:.1f} us median, {:.1f} us 99th percentile".format(
+        result['mean_us'], result['p50_us'], result['p99_us'])
+    result = results['run']
+    print "Simulator.run: {:.1f} steps/sec, {:.2f} trials/sec".format(result['steps_per_sec'], result['trials_per_sec'])
+
+    print
+    for result in results['hogwild']:
+        print "{:>3} workers: {:10.1f} transitions/sec, {:5.2f}x".format(result['workers'], result['transitions_per_sec'], result['speedup'])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['construct']: # Measure one construction for bench_construction
+        print json.dumps(measure_construction((int(sys.argv[2]), int(sys.argv[3])), int(sys.argv[4]), seed=int(sys.argv[5])))
+        sys.exit()
+
+    parser = argparse.ArgumentParser(description="Benchmark the smartcab simulation.")
+    parser.add_argument('--json', default=None, help="file to write the results to, as JSON")
+    parser.add_argument('--seed', type=int, default=0, help="seed of every benchmark")
+    parser.add_argument('--quick', action='store_true', help="shorter runs on smaller sizes")
+    parser.add_argument('--workers', type=int, nargs='+', default=None,
+                        help="worker counts of the hogwild benchmark (default: powers of two up to the number of cores)")
+    args = parser.parse_args()
+
+    results = run_suite(seed=args.seed, quick=args.quick, workers=args.workers)
+    print_suite(results)
+    if args.json is not None:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
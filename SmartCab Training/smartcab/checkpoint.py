@@ -0,0 +1,198 @@
+import os
+import random
+import numpy as np
+
+
+def capture(sim, counters):
+    """ The state of a simulation between two trials as a dict of arrays: the primary
+        agent's Q-table and decay counter (and those of the learners), the agents,
+        traffic lights and time of the environment, the state of the random number
+        generators, the positions of the trial log and the step trace, and the trial
+        counters of Simulator.run ('counters'). """
+
+    env = sim.env
+    a = env.primary_agent
+    agents = list(env.agent_states)  # creation order
+    version, internal, gauss_next = random.getstate()
+    np_state = np.random.get_state()
+    total_trials, testing, trial = counters
+
+    state = {
+        # Trial counters of Simulator.run
+        'total_trials': total_trials,
+        'testing': testing,
+        'trial': trial,
+
+        # Environment
+        't': env.t,
+        'location': np.array([env.agent_states[agent]['location'] for agent in agents], dtype=np.int32),
+        'heading': np.array([env.agent_states[agent]['heading'] for agent in agents], dtype=np.int32),
+        'waypoint': np.array([env.valid_actions.index(agent.get_next_waypoint()) for agent in agents], dtype=np.int8),
+        'color': np.array([agent.color for agent in agents]),
+        'primary': agents.index(a) if a is not None else -1,
+        'destination': np.array(env.agent_states[a].get('destination') or (0, 0), dtype=np.int32) if a is not None else np.zeros(2, dtype=np.int32),
+        'deadline': env.agent_states[a].get('deadline') or 0 if a is not None else 0,
+        'light_state': env.lights.state,
+        'light_period': env.lights.period,
+        'light_last_updated': env.lights.last_updated,
+
+        # Random number generators
+        'random_version': version,
+        'random_internal': np.array(internal, dtype=np.uint32),
+        'random_gauss_next': np.nan if gauss_next is None else gauss_next,
+        'np_random_keys': np_state[1],
+        'np_random_pos': np_state[2],
+        'np_random_has_gauss': np_state[3],
+        'np_random_cached_gaussian': np_state[4],
+
+        # Logs
+        'log_position': -1,
+        'trace_trial': sim.trace.trial if sim.trace is not None else 0,
+        'trace_count': -1
+    }
+
+    if sim.log_metrics:
+        sim.log_sink.flush()  # every logged trial is written and on disk
+        state['log_position'] = sim.log_file.count if sim.log_format == 'npy' else sim.log_file.tell()
+        if sim.learners_log_file is not None:
+            sim.learners_log_sink.flush()
+            state['learners_log_position'] = sim.learners_log_file.count if sim.log_format == 'npy' else sim.learners_log_file.tell()
+
+    if sim.trace is not None:
+        sim.trace.flush()  # every recorded step is in the file
+        state['trace_count'] = sim.trace.file.count
+
+    # Dummies of the traffic engine
+    if env.traffic is not None:
+        traffic_state = env.traffic.random.get_state()
+        state.update({
+            'traffic_location': env.traffic.location,
+            'traffic_heading': env.traffic.heading,
+            'traffic_waypoint': env.traffic.waypoint,
+            'traffic_color': env.traffic.color,
+            'traffic_random_keys': traffic_state[1],
+            'traffic_random_pos': traffic_state[2],
+            'traffic_random_has_gauss': traffic_state[3],
+            'traffic_random_cached_gaussian': traffic_state[4]
+        })
+
+    # Learning agent
+    if a is not None and hasattr(a, 'Q'):
+        state.update({
+            'Q': a.Q,
+            'Q_created': a.Q_created,
+            'x': a.x,
+            'epsilon': a.epsilon,
+            'alpha': a.alpha
+        })
+        if getattr(a, 'replay', None) is not None:
+            state.update({
+                'replay_state': a.replay.state,
+                'replay_action': a.replay.action,
+                'replay_reward': a.replay.reward,
+                'replay_position': a.replay.position,
+                'replay_size': a.replay.size
+            })
+
+    # Learners (which share the primary agent's Q-table)
+    if env.learners:
+        learners = list(env.learners)
+        state.update({
+            'learner_x': np.array([learner.x for learner in learners]),
+            'learner_epsilon': np.array([learner.epsilon for learner in learners]),
+            'learner_alpha': np.array([learner.alpha for learner in learners])
+        })
+
+    return state
+
+
+def save_checkpoint(filename, sim, counters):
+    """ Write a checkpoint of 'sim' to the .npz file 'filename'. The checkpoint is
+        written to a temporary file first, so a crash never leaves a partial one. """
+
+    state = capture(sim, counters)
+    temp_filename = filename + ".tmp"
+    with open(temp_filename, 'wb') as f:
+        np.savez(f, **state)
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)  # rename does not replace files on Windows
+    os.rename(temp_filename, filename)
+
+
+def load_checkpoint(filename):
+    """ Read a checkpoint written by save_checkpoint. """
+
+    with np.load(filename) as data:
+        return dict((name, data[name]) for name in data.files)
+
+
+def restore(sim, state):
+    """ Put 'sim' back in the state of a checkpoint. Returns the trial counters of
+        Simulator.run, (total_trials, testing, trial). The trial log is
+        rewound by the Simulator when it opens the log for resuming. """
+
+    env = sim.env
+    agents = list(env.agent_states)
+    if len(agents) != len(state['location']):
+        raise ValueError("The checkpoint has {} agents but the environment has {}.".format(len(state['location']), len(agents)))
+
+    # Environment
+    env.t = int(state['t'])
+    env.occupancy = {}
+    for i, agent in enumerate(agents):
+        env.agent_states[agent] = {
+            'location': tuple(int(v) for v in state['location'][i]),
+            'heading': tuple(int(v) for v in state['heading'][i])
+        }
+        if i == state['primary']:
+            env.agent_states[agent]['destination'] = tuple(int(v) for v in state['destination'])
+            env.agent_states[agent]['deadline'] = int(state['deadline'])
+        else:
+            env.agent_states[agent]['destination'] = None
+            env.agent_states[agent]['deadline'] = None
+        agent.next_waypoint = env.valid_actions[state['waypoint'][i]]
+        agent.color = str(state['color'][i])
+        env.occupy(agent, env.agent_states[agent]['location'])
+
+    env.lights.load(state['light_state'], state['light_period'], state['light_last_updated'], env.t)
+
+    if env.traffic is not None:
+        env.traffic.location = state['traffic_location'].copy()
+        env.traffic.heading = state['traffic_heading'].copy()
+        env.traffic.waypoint = state['traffic_waypoint'].copy()
+        env.traffic.color = state['traffic_color'].copy()
+        env.traffic.random.set_state(('MT19937', state['traffic_random_keys'], int(state['traffic_random_pos']),
+                                      int(state['traffic_random_has_gauss']), float(state['traffic_random_cached_gaussian'])))
+        env.traffic._moved()
+
+    # Learning agent
+    a = env.primary_agent
+    if 'Q' in state:
+        a.Q[:] = state['Q']
+        a.Q_created[:] = state['Q_created']
+        a.x = int(state['x'])
+        a.epsilon = float(state['epsilon'])
+        a.alpha = float(state['alpha'])
+    if 'replay_state' in state:
+        a.replay.state[:] = state['replay_state']
+        a.replay.action[:] = state['replay_action']
+        a.replay.reward[:] = state['replay_reward']
+        a.replay.position = int(state['replay_position'])
+        a.replay.size = int(state['replay_size'])
+    if 'learner_x' in state:
+        for i, learner in enumerate(env.learners):
+            learner.x = int(state['learner_x'][i])
+            learner.epsilon = float(state['learner_epsilon'][i])
+            learner.alpha = float(state['learner_alpha'][i])
+
+    # Random number generators
+    gauss_next = float(state['random_gauss_next'])
+    random.setstate((int(state['random_version']), tuple(long(v) for v in state['random_internal']),
+                     None if np.isnan(gauss_next) else gauss_next))
+    np.random.set_state(('MT19937', state['np_random_keys'], int(state['np_random_pos']),
+                         int(state['np_random_has_gauss']), float(state['np_random_cached_gaussian'])))
+
+    if sim.trace is not None:
+        sim.trace.trial = int(state['trace_trial'])
+
+    return int(state['total_trials']), bool(state['testing']), int(state['trial'])
@@ -1,13 +1,17 @@
 import time
 import random
 import math
+from bisect import insort
 from collections import OrderedDict
+import numpy as np
 from simulator import Simulator
+from output import console, STEP
 
 
 class TrafficLight(object):
     """A traffic light that switches periodically."""
 
+    __slots__ = ('state', 'period', 'last_updated')  # no per-light __dict__, for large grids
     valid_states = [True, False]  # True = NS open; False = EW open
 
     def __init__(self, state=None, period=None):
@@ -24,6 +28,71 @@ class TrafficLight(object):
             self.last_updated = t
 
 
+class LightBank(object):
+    """ The traffic lights of all intersections, as arrays of state, period and last_updated.
+
+        Light i switches like a TrafficLight, when t - last_updated[i] >= period[i]. Instead
+        of checking every light on every step, the lights are kept on a timing wheel by
+        the time of their next switch, so update(t) only touches the lights that switch at t.
+        Each wheel slot holds groups of lights with the same period and switch times; such
+        lights keep switching together, so groups are moved along the wheel as a whole. """
+
+    valid_states = TrafficLight.valid_states
+    valid_periods = [2, 3, 4, 5]
+
+    def __init__(self, n_lights):
+        # Draw each light's state and period in the same order as TrafficLight() does
+        state = []
+        period = []
+        for i in xrange(n_lights):
+            state.append(random.choice(self.valid_states))
+            period.append(random.choice(self.valid_periods))
+        self.load(state, period, np.zeros(n_lights), 0)
+
+    def load(self, state, period, last_updated, t):
+        """ Set every light's state, period and last_updated, as of time 't',
+            and schedule their next switches. """
+
+        self.state = np.array(state, dtype=bool)
+        self.period = np.array(period, dtype=np.int32)
+        self.last_updated = np.array(last_updated, dtype=np.int32)
+        self.wheel_size = max(self.valid_periods + self.period.tolist()) + 1
+        self._reset_wheel = self._schedule(np.zeros_like(self.last_updated), 0)
+        self.wheel = self._schedule(self.last_updated, t)
+
+    def _schedule(self, last_updated, t):
+        """ A timing wheel of the lights by their next switch after 'last_updated',
+            as of time 't' (overdue lights switch at the next update). """
+
+        wheel = [[] for i in xrange(self.wheel_size)]
+        next_switch = np.maximum(last_updated + self.period, t)
+        key = next_switch.astype(np.int64) * self.wheel_size + self.period
+        order = np.argsort(key, kind='mergesort')
+        for group in np.split(order, np.flatnonzero(np.diff(key[order])) + 1) if len(order) else []:
+            i = group[0]
+            wheel[next_switch[i] % self.wheel_size].append((int(self.period[i]), group))
+        return wheel
+
+    def reset(self):
+        """ Start every light's period over at time 0 (as TrafficLight.reset). """
+
+        self.last_updated[:] = 0
+        self.wheel = [list(groups) for groups in self._reset_wheel]
+
+    def update(self, t):
+        """ Switch the lights that are due at time 't'. Called once per time step. """
+
+        slot = t % self.wheel_size
+        groups = self.wheel[slot]
+        if not groups:
+            return
+        self.wheel[slot] = []
+        for period, group in groups:
+            self.state[group] ^= True
+            self.last_updated[group] = t
+            self.wheel[(t + period) % self.wheel_size].append((period, group))
+
+
 class Environment(object):
     """Environment within which all agents operate."""
 
@@ -32,7 +101,7 @@ class Environment(object):
     valid_headings = [(1, 0), (0, -1), (-1, 0), (0, 1)]  # E, N, W, S
     hard_time_limit = -100  # Set a hard time limit even if deadline is not enforced.
 
-    def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6)):
+    def __init__(self, verbose=False, num_dummies=100, grid_size = (8, 6), routing_table=False, traffic_engine=False):
         self.num_dummies = num_dummies  # Number of dummy driver agents in the environment
         self.verbose = verbose # If debug output should be given
 
@@ -40,42 +109,58 @@ class Environment(object):
         self.done = False
         self.t = 0
         self.agent_states = OrderedDict()
+        self.occupancy = {}  # (creation order, agent) pairs at each occupied intersection
+        self.agent_order = {}  # creation order of each agent, used to keep 'occupancy' sorted
         self.step_data = {}
         self.success = None
+        self.trace = None  # optional recorder of every step of the primary agent (see steptrace.TraceRecorder)
+        self.stats = None  # optional time spent in each phase of a step (see profiling.PhaseStats)
 
         # Road network
         self.grid_size = grid_size  # (columns, rows)
         self.bounds = (1, 2, self.grid_size[0], self.grid_size[1] + 1)
         self.block_size = 100
         self.hang = 0.6
-        self.intersections = OrderedDict()
-        self.roads = []
-        for x in xrange(self.bounds[0], self.bounds[2] + 1):
-            for y in xrange(self.bounds[1], self.bounds[3] + 1):
-                self.intersections[(x, y)] = TrafficLight()  # A traffic light at each intersection
-
-        for a in self.intersections:
-            for b in self.intersections:
-                if a == b:
-                    continue
-                if (abs(a[0] - b[0]) + abs(a[1] - b[1])) == 1:  # L1 distance = 1
-                    self.roads.append((a, b))
+        self.locations = [(x, y) for x in xrange(self.bounds[0], self.bounds[2] + 1) for y in xrange(self.bounds[1], self.bounds[3] + 1)]
+        self.intersections = dict((location, i) for i, location in enumerate(self.locations))  # light index of each intersection
+        self.lights = LightBank(len(self.locations))  # A traffic light at each intersection
+
+        # Roads as an array of (start, end) points: one to the neighbour East and South of each intersection
+        x, y = np.meshgrid(np.arange(self.bounds[0], self.bounds[2] + 1), np.arange(self.bounds[1], self.bounds[3] + 1), indexing='ij')
+        east = np.stack([x[:-1], y[:-1], x[1:], y[1:]], axis=-1).reshape(-1, 2, 2)
+        south = np.stack([x[:, :-1], y[:, :-1], x[:, 1:], y[:, 1:]], axis=-1).reshape(-1, 2, 2)
 
         # Add environment boundaries
-        for x in xrange(self.bounds[0], self.bounds[2] + 1):
-            self.roads.append(((x, self.bounds[1] - self.hang), (x, self.bounds[1])))
-            self.roads.append(((x, self.bounds[3] + self.hang), (x, self.bounds[3])))
-        for y in xrange(self.bounds[1], self.bounds[3] + 1):
-            self.roads.append(((self.bounds[0] - self.hang, y), (self.bounds[0], y)))
-            self.roads.append(((self.bounds[2] + self.hang, y), (self.bounds[2], y)))    
+        columns = np.arange(self.bounds[0], self.bounds[2] + 1)
+        rows = np.arange(self.bounds[1], self.bounds[3] + 1)
+        top = np.stack([columns, np.full(len(columns), self.bounds[1] - self.hang), columns, np.full(len(columns), self.bounds[1])], axis=-1)
+        bottom = np.stack([columns, np.full(len(columns), self.bounds[3] + self.hang), columns, np.full(len(columns), self.bounds[3])], axis=-1)
+        left = np.stack([np.full(len(rows), self.bounds[0] - self.hang), rows, np.full(len(rows), self.bounds[0]), rows], axis=-1)
+        right = np.stack([np.full(len(rows), self.bounds[2] + self.hang), rows, np.full(len(rows), self.bounds[2]), rows], axis=-1)
+        self.roads = np.concatenate([east, south] + [edge.reshape(-1, 2, 2) for edge in [top, bottom, left, right]]).astype(float)
+
+        # Precomputed waypoints, distances and trips (see routing.RoutingTable)
+        self.routes = None
+        if routing_table:
+            from routing import RoutingTable
+            self.routes = RoutingTable(self.grid_size, self.bounds, self.valid_actions, self.valid_headings)
 
         # Create dummy agents
-        for i in xrange(self.num_dummies):
-            self.create_agent(DummyAgent)
+        if self.num_dummies > len(self.valid_headings) * len(self.locations):
+            raise ValueError("Cannot place {} dummy agents on {} intersections: each intersection holds at most {}.".format(
+                self.num_dummies, len(self.locations), len(self.valid_headings)))
+        self.traffic = None  # array-backed dummy agents (see traffic.TrafficEngine)
+        if traffic_engine:
+            from traffic import TrafficEngine
+            self.traffic = TrafficEngine(self, self.num_dummies, seed=random.getrandbits(32))
+        else:
+            for i in xrange(self.num_dummies):
+                self.create_agent(DummyAgent)
 
         # Primary agent and associated parameters
         self.primary_agent = None  # to be set explicitly
         self.enforce_deadline = False
+        self.learners = OrderedDict()  # trial data of each additional learning agent (see add_learner)
 
         # Trial data (updated at the end of each trial)
         self.trial_data = {
@@ -92,9 +177,24 @@ class Environment(object):
         """ When called, create_agent creates an agent in the environment. """
 
         agent = agent_class(self, *args, **kwargs)
-        self.agent_states[agent] = {'location': random.choice(self.intersections.keys()), 'heading': (0, 1)}
+        self.agent_states[agent] = {'location': random.choice(self.locations), 'heading': (0, 1)}
+        self.agent_order[agent] = len(self.agent_order)
+        self.occupy(agent, self.agent_states[agent]['location'])
         return agent
 
+    def occupy(self, agent, location):
+        """ Record 'agent' in the occupancy index of the intersection at 'location'. """
+
+        insort(self.occupancy.setdefault(location, []), (self.agent_order[agent], agent))
+
+    def vacate(self, agent, location):
+        """ Remove 'agent' from the occupancy index of the intersection at 'location'. """
+
+        occupants = self.occupancy[location]
+        occupants.remove((self.agent_order[agent], agent))
+        if not occupants:
+            del self.occupancy[location]
+
     def set_primary_agent(self, agent, enforce_deadline=False):
         """ When called, set_primary_agent sets 'agent' as the primary agent.
             The primary agent is the smartcab that is followed in the environment. """
@@ -103,6 +203,15 @@ class Environment(object):
         agent.primary_agent = True
         self.enforce_deadline = enforce_deadline
 
+    def add_learner(self, agent):
+        """ Add 'agent' as a learning agent next to the primary agent. Each trial, a learner
+            gets a start, destination and deadline of its own, and its metrics in
+            'learners'. Learners are not followed: once one reaches its destination or
+            runs out of time it waits for the primary agent's trial to end. Like the
+            primary agent, learners are invisible to the other agents. """
+
+        self.learners[agent] = {}
+
     def reset(self, testing=False):
         """ This function is called at the beginning of a new trial. """
 
@@ -111,34 +220,32 @@ class Environment(object):
 
         # Reset status text
         self.step_data = {}
+        if self.trace is not None:
+            self.trace.new_trial(testing)
 
         # Reset traffic lights
-        for traffic_light in self.intersections.itervalues():
-            traffic_light.reset()
+        self.lights.reset()
 
         # Pick a start and a destination
-        start = random.choice(self.intersections.keys())
-        destination = random.choice(self.intersections.keys())
-
-        # Ensure starting location and destination are not too close
-        while self.compute_dist(start, destination) < 4:
-            start = random.choice(self.intersections.keys())
-            destination = random.choice(self.intersections.keys())
-
+        start, destination = self.sample_trip()
         start_heading = random.choice(self.valid_headings)
         distance = self.compute_dist(start, destination)
         deadline = distance * 5 # 5 time steps per intersection away
         if(self.verbose == True): # Debugging
-            print "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}".format(start, destination, deadline)
-
-        # Create a map of all possible initial positions
-        positions = dict()
-        for location in self.intersections:
-            positions[location] = list()
-            for heading in self.valid_headings:
-                positions[location].append(heading)
+            console.log(STEP, "Environment.reset(): Trial set up with start = {}, destination = {}, deadline = {}", start, destination, deadline)
+
+        # Draw a distinct (intersection, heading) slot for each dummy agent at once,
+        # sampling without replacement from the slot numbers 4 * location index + heading index
+        n_headings = len(self.valid_headings)
+        n_dummies = len(self.agent_states) - (self.primary_agent in self.agent_states) - len(self.learners)
+        n_traffic = self.traffic.num_dummies if self.traffic is not None else 0
+        slots = random.sample(xrange(n_headings * len(self.locations)), n_traffic + n_dummies)
+        if self.traffic is not None:
+            self.traffic.place(slots[:n_traffic])
+        slots = iter(slots[n_traffic:])
 
         # Initialize agent(s)
+        self.occupancy = {}
         for agent in self.agent_states.iterkeys():
 
             if agent is self.primary_agent:
@@ -148,24 +255,28 @@ class Environment(object):
                     'destination': destination,
                     'deadline': deadline
                 }
-            # For dummy agents, make them choose one of the available 
-            # intersections and headings still in 'positions'
+            # For learners, a trip of their own
+            elif agent in self.learners:
+                learner_start, learner_destination = self.sample_trip()
+                self.agent_states[agent] = {
+                    'location': learner_start,
+                    'heading': random.choice(self.valid_headings),
+                    'destination': learner_destination,
+                    'deadline': self.compute_dist(learner_start, learner_destination) * 5
+                }
+            # For dummy agents, take the next of the drawn slots
             else:
-                intersection = random.choice(positions.keys())
-                heading = random.choice(positions[intersection])
+                slot = next(slots)
                 self.agent_states[agent] = {
-                    'location': intersection,
-                    'heading': heading,
+                    'location': self.locations[slot // n_headings],
+                    'heading': self.valid_headings[slot % n_headings],
                     'destination': None,
                     'deadline': None
                 }
-                # Now delete the taken location and heading from 'positions'
-                positions[intersection] = list(set(positions[intersection]) - set([heading]))
-                if positions[intersection] == list(): # No headings available for intersection
-                    del positions[intersection] # Delete the intersection altogether
 
+            self.occupy(agent, self.agent_states[agent]['location'])
     
-            agent.reset(destination=(destination if agent is self.primary_agent else None), testing=testing)
+            agent.reset(destination=self.agent_states[agent]['destination'], testing=testing)
             if agent is self.primary_agent:
                 # Reset metrics for this trial (step data will be set during the step)
                 self.trial_data['testing'] = testing
@@ -175,31 +286,55 @@ class Environment(object):
                 self.trial_data['actions'] = {0: 0, 1: 0, 2: 0, 3: 0, 4: 0}
                 self.trial_data['parameters'] = {'e': agent.epsilon, 'a': agent.alpha}
                 self.trial_data['success'] = 0
+            elif agent in self.learners:
+                learner_deadline = self.agent_states[agent]['deadline']
+                self.learners[agent] = {
+                    'testing': testing,
+                    'initial_deadline': learner_deadline,
+                    'final_deadline': learner_deadline,
+                    'net_reward': 0.0,
+                    'actions': {0: 0, 1: 0, 2: 0, 3: 0, 4: 0},
+                    'parameters': {'e': agent.epsilon, 'a': agent.alpha},
+                    'success': 0,
+                    'done': False  # whether the learner reached its destination or ran out of time
+                }
+
+    def sample_trip(self):
+        """ A random (start, destination) pair at least 4 intersections apart. """
+
+        if self.routes is not None: # Draw directly from the pairs that are far enough apart
+            return self.routes.sample_trip()
+
+        start = random.choice(self.locations)
+        destination = random.choice(self.locations)
+
+        # Ensure starting location and destination are not too close
+        while self.compute_dist(start, destination) < 4:
+            start = random.choice(self.locations)
+            destination = random.choice(self.locations)
+
+        return start, destination
 
     def step(self):
         """ This function is called when a time step is taken turing a trial. """
 
         # Pretty print to terminal
-        print ""
-        print "/-------------------"
-        print "| Step {} Results".format(self.t)
-        print "\-------------------"
-        print ""
+        console.log(STEP, "\n/-------------------\n| Step {} Results\n\-------------------\n", self.t)
 
         if(self.verbose == True): # Debugging
-            print "Environment.step(): t = {}".format(self.t)
+            console.log(STEP, "Environment.step(): t = {}", self.t)
 
-        # Update agents, primary first
+        # Update agents, primary first, then the learners
         if self.primary_agent is not None:
             self.primary_agent.update()
 
-        for agent in self.agent_states.iterkeys():
-            if agent is not self.primary_agent:
-                agent.update()
+        if self.learners:
+            self._update_learners()
+
+        self._update_dummies()
 
         # Update traffic lights
-        for intersection, traffic_light in self.intersections.iteritems():
-            traffic_light.update(self.t)
+        self._update_lights()
 
         if self.primary_agent is not None:
             # Agent has taken an action: reduce the deadline by 1
@@ -210,15 +345,46 @@ class Environment(object):
                 self.done = True
                 self.success = False
                 if self.verbose: # Debugging
-                    print "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.".format(self.hard_time_limit)
+                    console.log(STEP, "Environment.step(): Primary agent hit hard time limit ({})! Trial aborted.", self.hard_time_limit)
             elif self.enforce_deadline and agent_deadline <= 0:
                 self.done = True
                 self.success = False
                 if self.verbose: # Debugging
-                    print "Environment.step(): Primary agent ran out of time! Trial aborted."
+                    console.log(STEP, "Environment.step(): Primary agent ran out of time! Trial aborted.")
+
+        # Learners have taken an action: reduce their deadlines
+        for agent, data in self.learners.iteritems():
+            if not data['done']:
+                agent_deadline = self.agent_states[agent]['deadline'] - 1
+                self.agent_states[agent]['deadline'] = agent_deadline
+                if agent_deadline <= self.hard_time_limit or (self.enforce_deadline and agent_deadline <= 0):
+                    data['done'] = True
 
         self.t += 1
 
+    def _update_learners(self):
+        """ Update every learner that is still on its way. """
+
+        for agent, data in self.learners.iteritems():
+            if not data['done']:
+                agent.update()
+
+    def _update_dummies(self):
+        """ Update every dummy agent, then the dummies of the traffic engine. """
+
+        learners = self.learners
+        for agent in self.agent_states.iterkeys():
+            if agent is not self.primary_agent and agent not in learners:
+                agent.update()
+
+        if self.traffic is not None:
+            self.traffic.step(self.lights.state[self.traffic.location])
+
+    def _update_lights(self):
+        """ Switch the traffic lights that are due (only those are touched). """
+
+        self.lights.update(self.t)
+
     def sense(self, agent):
         """ This function is called when information is requested about the sensor
             inputs from an 'agent' in the environment. """
@@ -228,18 +394,24 @@ class Environment(object):
         state = self.agent_states[agent]
         location = state['location']
         heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+        ns_open = self.lights.state[self.intersections[location]]
+        light = 'green' if (ns_open and heading[1] != 0) or ((not ns_open) and heading[0] != 0) else 'red'
 
         # Populate oncoming, left, right
+        # Only agents at the same intersection are considered, in creation order
         oncoming = None
         left = None
         right = None
-        for other_agent, other_state in self.agent_states.iteritems():
-            if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
+        if self.traffic is not None: # Dummies of the traffic engine come first in creation order
+            inputs = self.traffic.sense(location, heading)
+            oncoming, left, right = inputs['oncoming'], inputs['left'], inputs['right']
+        for _, other_agent in self.occupancy[location]:
+            other_state = self.agent_states[other_agent]
+            if agent == other_agent or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
                 continue
-            # For dummy agents, ignore the primary agent
-            # This is because the primary agent is not required to follow the waypoint
-            if other_agent == self.primary_agent:
+            # For dummy agents, ignore the primary agent and the learners
+            # This is because learning agents are not required to follow the waypoint
+            if other_agent == self.primary_agent or other_agent in self.learners:
                 continue
             other_heading = other_agent.get_next_waypoint()
             if (heading[0] * other_state['heading'][0] + heading[1] * other_state['heading'][1]) == -1:
@@ -257,7 +429,7 @@ class Environment(object):
     def get_deadline(self, agent):
         """ Returns the deadline remaining for an agent. """
 
-        return self.agent_states[agent]['deadline'] if agent is self.primary_agent else None
+        return self.agent_states[agent]['deadline'] if agent is self.primary_agent or agent in self.learners else None
 
     def act(self, agent, action):
         """ Consider an action and perform the action if it is legal.
@@ -269,7 +441,8 @@ class Environment(object):
         state = self.agent_states[agent]
         location = state['location']
         heading = state['heading']
-        light = 'green' if (self.intersections[location].state and heading[1] != 0) or ((not self.intersections[location].state) and heading[0] != 0) else 'red'
+        ns_open = self.lights.state[self.intersections[location]]
+        light = 'green' if (ns_open and heading[1] != 0) or ((not ns_open) and heading[0] != 0) else 'red'
         inputs = self.sense(agent)
 
         # Assess whether the agent can move based on the action chosen.
@@ -287,7 +460,7 @@ class Environment(object):
 
         # Create a penalty factor as a function of remaining deadline
         # Scales reward multiplicatively from [0, 1]
-        fnc = self.t * 1.0 / (self.t + state['deadline']) if agent.primary_agent else 0.0
+        fnc = self.t * 1.0 / (self.t + state['deadline']) if agent is self.primary_agent or agent in self.learners else 0.0
         gradient = 10
         
         # No penalty given to an agent that has no enforced deadline
@@ -344,6 +517,8 @@ class Environment(object):
             if action is not None:
                 location = ((location[0] + heading[0] - self.bounds[0]) % (self.bounds[2] - self.bounds[0] + 1) + self.bounds[0],
                             (location[1] + heading[1] - self.bounds[1]) % (self.bounds[3] - self.bounds[1] + 1) + self.bounds[1])  # wrap-around
+                self.vacate(agent, state['location'])
+                self.occupy(agent, location)
                 state['location'] = location
                 state['heading'] = heading
         # Agent attempted invalid move
@@ -369,10 +544,10 @@ class Environment(object):
                 self.success = True
 
                 if(self.verbose == True): # Debugging
-                    print "Environment.act(): Primary agent has reached destination!"
+                    console.log(STEP, "Environment.act(): Primary agent has reached destination!")
 
             if(self.verbose == True): # Debugging
-                print "Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}".format(location, heading, action, reward)
+                console.log(STEP, "Environment.act() [POST]: location: {}, heading: {}, action: {}, reward: {}", location, heading, action, reward)
 
             # Update metrics
             self.step_data['t'] = self.t
@@ -389,13 +564,32 @@ class Environment(object):
             self.trial_data['net_reward'] += reward
             self.trial_data['actions'][violation] += 1
 
+            if self.trace is not None:
+                self.trace.record(self.t, agent.get_state(), agent.get_next_waypoint(), inputs, light, action,
+                                  reward, violation, state['deadline'], self.trial_data['success'])
+
             if(self.verbose == True): # Debugging
-                print "Environment.act(): Step data: {}".format(self.step_data)
+                console.log(STEP, "Environment.act(): Step data: {}", self.step_data)
+
+        # Update the metrics of a learner
+        elif agent in self.learners:
+            data = self.learners[agent]
+            if state['location'] == state['destination']:
+                if state['deadline'] >= 0:
+                    data['success'] = 1
+                data['done'] = True
+            data['final_deadline'] = state['deadline'] - 1
+            data['net_reward'] += reward
+            data['actions'][violation] += 1
+
         return reward
 
     def compute_dist(self, a, b):
         """ Compute the Manhattan (L1) distance of a spherical world. """
 
+        if self.routes is not None:
+            return self.routes.distance(a, b)
+
         dx1 = abs(b[0] - a[0])
         dx2 = abs(self.grid_size[0] - dx1)
         dx = dx1 if dx1 < dx2 else dx2
@@ -0,0 +1,191 @@
+import random
+import traceback
+import multiprocessing
+import Queue
+from timeit import default_timer
+import numpy as np
+from environment import Environment
+from agent import LearningAgent
+from qtable import StateEncoder, save_qtable
+from records import open_trial_log, trial_row, trial_fields, trial_dtype
+from output import console, QUIET, RUN, TRIAL
+
+
+def shared_qtable(encoder, n_actions):
+    """ A zeroed Q-table and its created flags for the states of 'encoder', in shared
+        memory that worker processes inherit. Returns the two raw buffers, which have
+        no lock: workers read and write them concurrently (Hogwild-style). """
+
+    return (multiprocessing.RawArray('d', encoder.n_states * n_actions),
+            multiprocessing.RawArray('b', encoder.n_states))
+
+
+def attach_qtable(agent, Q_buffer, created_buffer):
+    """ Make 'agent' learn into the shared Q-table of shared_qtable. """
+
+    agent.Q = np.frombuffer(Q_buffer).reshape(agent.Q.shape)
+    agent.Q_created = np.frombuffer(created_buffer, dtype=np.bool_)
+
+
+def _work(seed, env_kwargs, agent_kwargs, Q_buffer, created_buffer, tasks, results):
+    """ Worker process: run the trials sent on 'tasks' in an Environment of its own,
+        learning into the shared Q-table, and send the trial data back on 'results'.
+        If anything fails, the traceback is sent instead (with trial None) and the
+        worker stops. """
+
+    console.set_level(QUIET)
+    random.seed(seed)  # None seeds from the operating system, so forked workers don't share a sequence
+    np.random.seed(seed)
+
+    try:
+        env = Environment(**env_kwargs)
+        agent = env.create_agent(LearningAgent, learning=True, **agent_kwargs)
+        attach_qtable(agent, Q_buffer, created_buffer)
+        env.set_primary_agent(agent, enforce_deadline=True)
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            trial, testing, epsilon, alpha = task
+
+            env.reset(testing)
+            # The coordinator owns the decay schedule
+            agent.epsilon = epsilon
+            agent.alpha = alpha
+            env.trial_data['parameters'] = {'e': epsilon, 'a': alpha}
+
+            steps = 0
+            while not env.done:
+                env.step()
+                steps += 1
+            results.put((trial, testing, steps, dict(env.trial_data)))  # a copy: the queue pickles it later, in a thread
+    except Exception:
+        results.put((None, None, None, traceback.format_exc()))
+
+
+def _next_result(results, processes, timeout=1.0):
+    """ The next message on 'results'. Raises RuntimeError if a worker sent an error,
+        or if a worker died without sending one (workers only exit when told to). """
+
+    while True:
+        try:
+            trial, testing, steps, data = results.get(timeout=timeout)
+        except Queue.Empty:
+            for p in processes:
+                if not p.is_alive():
+                    raise RuntimeError("Hogwild worker {} died with exit code {}.".format(p.name, p.exitcode))
+            continue
+        if trial is None:
+            raise RuntimeError("A Hogwild worker failed:\n" + data)
+        return trial, testing, steps, data
+
+
+def train(workers=None, seed=None, alpha=0.25, constant_a=0.995, tolerance=0.3688, min_train=20, n_test=10,
+          env_kwargs=None, agent_kwargs=None, log_filename=None, log_format='csv', Q_filename=None):
+    """ Train one LearningAgent Q-table with 'workers' processes (default: one per core),
+        each running trials in an Environment of its own and writing to the Q-table in
+        shared memory without locks. Worker i is seeded with 'seed' + i, or from the
+        operating system when 'seed' is None. Even seeded, runs are not reproducible:
+        trials go to whichever worker is free, and updates of the table race.
+
+        The coordinator (this process) owns the decay schedule and the trial log: trial
+        t is trained with epsilon = constant_a ** t, as LearningAgent decays it, and
+        testing starts, as in Simulator.run, once more than 'min_train' trials are done
+        and epsilon is below 'tolerance'. The 'n_test' testing trials wait for the
+        training trials still running. Trials are logged in the order they finish, in
+        the format of the Simulator's log.
+
+        'env_kwargs' are checked by building an Environment here before the workers
+        start. If a worker fails or dies, the others are stopped and RuntimeError is
+        raised.
+
+        Returns the trial data of every trial, the final Q-table and created flags,
+        and the training throughput. """
+
+    env_kwargs = env_kwargs or {}
+    agent_kwargs = dict(agent_kwargs or {}, alpha=alpha, constant_a=constant_a, tolerance=tolerance)
+    workers = workers or multiprocessing.cpu_count()
+    Environment(**env_kwargs)  # raises here, rather than in every worker, if the world is invalid
+
+    encoder = StateEncoder([Environment.valid_actions, ['green', 'red'], Environment.valid_actions])  # the states of LearningAgent
+    Q_buffer, created_buffer = shared_qtable(encoder, len(Environment.valid_actions))
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=_work, args=(seed + i if seed is not None else None, env_kwargs, agent_kwargs, Q_buffer, created_buffer, tasks, results))
+                 for i in xrange(workers)]
+    for p in processes:
+        p.daemon = True
+        p.start()
+
+    log_file = None
+    if log_filename is not None:
+        log_file, log_sink = open_trial_log(log_filename, log_format, trial_dtype, trial_fields)
+
+    trials = []
+    training_steps = 0
+    training_seconds = 0.0
+    start = default_timer()
+    next_trial = 1  # next trial to send, counted over the whole run
+    next_test = 1   # next testing trial to send
+    testing = False
+    running = {False: 0, True: 0}  # trials running, by testing flag
+    try:
+        while True:
+            # Keep every worker busy
+            while running[False] + running[True] < workers:
+                if not testing and next_trial > min_train and constant_a ** (next_trial - 1) < tolerance:
+                    testing = True
+                if not testing:
+                    tasks.put((next_trial, False, constant_a ** next_trial, alpha))
+                    next_trial += 1
+                elif next_test <= n_test and running[False] == 0:
+                    tasks.put((next_test, True, 0.0, 0.0))
+                    next_test += 1
+                else:
+                    break
+                running[testing] += 1
+            if running[False] + running[True] == 0:
+                break
+
+            trial, trial_testing, steps, data = _next_result(results, processes)
+            running[trial_testing] -= 1
+            if not trial_testing:
+                training_steps += steps
+                training_seconds = default_timer() - start
+            trials.append(data)
+            console.log(TRIAL, "{} trial {}: {} in {} steps.", "Testing" if trial_testing else "Training", trial,
+                        "success" if data['success'] else "failure", steps)
+
+            if log_file is not None:
+                log_sink.write(trial_row(log_format, trial, data))
+    except BaseException:
+        # Workers may be stuck on a trial or gone: don't wait for them
+        for p in processes:
+            p.terminate()
+        raise
+    finally:
+        for p in processes:
+            tasks.put(None)
+        for p in processes:
+            p.join()
+        if log_file is not None:
+            log_sink.close()
+            log_file.close()
+
+    Q = np.frombuffer(Q_buffer).reshape(encoder.n_states, len(Environment.valid_actions)).copy()
+    created = np.frombuffer(created_buffer, dtype=np.bool_).copy()
+    if Q_filename is not None:
+        save_qtable(Q_filename, encoder, Q, created)
+
+    throughput = {
+        'workers': workers,
+        'transitions': training_steps,
+        'seconds': training_seconds,
+        'transitions_per_sec': training_steps / training_seconds if training_seconds > 0 else float('inf')
+    }
+    console.log(RUN, "{} workers trained on {} transitions in {:.2f} seconds: {:.1f} transitions/sec",
+                workers, training_steps, training_seconds, throughput['transitions_per_sec'])
+    console.flush()
+    return {'trials': trials, 'Q': Q, 'created': created, 'throughput': throughput}
+
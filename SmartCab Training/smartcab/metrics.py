@@ -0,0 +1,94 @@
+import re
+import numpy as np
+
+# Rolling metrics computed by trial_metrics, in column order
+rolling_columns = ['average_reward', 'reliability_rate', 'good', 'minor', 'major', 'minor_acc', 'major_acc']
+
+
+def parse_actions(column):
+    """ Parse a log column of stringified action-count dicts ({0: n0, ..., 4: n4})
+        into an integer matrix with one row per trial, in a single pass. """
+
+    pairs = np.array(re.findall(r'(\d+):\s*(-?\d+)', ' '.join(column)), dtype=np.int64).reshape(-1, 5, 2)
+    actions = np.zeros((len(pairs), 5), dtype=np.int64)
+    actions[np.arange(len(pairs))[:, None], pairs[:, :, 0]] = pairs[:, :, 1]
+    return actions
+
+
+def parse_parameter(column, name):
+    """ Parse parameter 'name' out of a log column of stringified parameter dicts. """
+
+    return np.array(re.findall(r"'{}':\s*([^,}}]+)".format(name), ' '.join(column)), dtype=float)
+
+
+def rolling_mean(values, window):
+    """ Rolling mean over the rows of 'values' (1-D, or 2-D for several columns at
+        once). The first 'window' - 1 rows are NaN. """
+
+    values = np.asarray(values, dtype=float)
+    totals = np.cumsum(values, axis=0)
+    means = np.full(values.shape, np.nan)
+    if len(values) >= window:
+        means[window - 1] = totals[window - 1]
+        means[window:] = totals[window:] - totals[:-window]
+        means[window - 1:] /= window
+    return means
+
+
+def trial_metrics(actions, steps, net_reward, success, window=10):
+    """ Rolling average reward per action, reliability rate (%) and relative frequency
+        of each action class over 'window' trials, computed together. Returns a
+        matrix with one column per name in 'rolling_columns'. """
+
+    steps = np.asarray(steps, dtype=float)
+    rates = np.column_stack([np.asarray(net_reward) / steps, np.asarray(success) * 100.0,
+                             np.asarray(actions) / steps[:, None]])
+    return rolling_mean(rates, window)
+
+
+def safety_rating(actions, steps):
+    """ Calculates the safety rating of the smartcab from its testing trials.
+        'actions' holds the five action counts of each trial (good, minor violation,
+        major violation, minor accident, major accident) and 'steps' the number of
+        actions taken in each trial. """
+
+    actions = np.asarray(actions).reshape(-1, 5)
+    totals = actions.sum(axis=0)
+
+    good_ratio = totals[0] * 1.0 / np.sum(steps)
+
+    if good_ratio == 1: # Perfect driving
+        return ("A+", "green")
+    else: # Imperfect driving
+        if totals[4] > 0: # Major accident
+            return ("F", "red")
+        elif totals[3] > 0: # Minor accident
+            return ("D", "#EEC700")
+        elif totals[2] > 0: # Major violation
+            return ("C", "#EEC700")
+        else: # Minor violation
+            if totals[1] >= len(actions) / 2: # Minor violation in at least half of the trials
+                return ("B", "green")
+            else:
+                return ("A", "green")
+
+
+def reliability_rating(success):
+    """ Calculates the reliability rating of the smartcab from the success
+        (1 if the destination was reached in time) of its testing trials. """
+
+    success_ratio = np.sum(success) * 1.0 / len(success)
+
+    if success_ratio == 1: # Always meets deadline
+        return ("A+", "green")
+    else:
+        if success_ratio >= 0.90:
+            return ("A", "green")
+        elif success_ratio >= 0.80:
+            return ("B", "green")
+        elif success_ratio >= 0.70:
+            return ("C", "#EEC700")
+        elif success_ratio >= 0.60:
+            return ("D", "#EEC700")
+        else:
+            return ("F", "red")
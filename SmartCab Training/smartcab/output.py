@@ -0,0 +1,56 @@
+import sys
+import atexit
+
+# Verbosity levels, each including the ones before it
+QUIET = 0  # no output
+RUN = 1    # start and end of the run, warnings and summaries
+TRIAL = 2  # start and result of each trial
+STEP = 3   # every step: the environment, the agent's choices and the step results (the default)
+
+
+class Console(object):
+    """ Leveled, buffered terminal output shared by the agent, environment and simulator.
+
+        A message is only formatted if its level is enabled, so messages of disabled
+        levels cost a comparison. Lines are collected and written to 'stream'
+        (sys.stdout at the time of writing, by default) in batches of 'buffer_lines',
+        and whenever flush() is called: at the end of each trial and of the run,
+        on every frame of an interactive run, and at exit. """
+
+    def __init__(self, level=STEP, stream=None, buffer_lines=256):
+        self.level = level
+        self.stream = stream
+        self.buffer_lines = buffer_lines
+        self.lines = []
+
+    def enabled(self, level):
+        """ Whether messages of 'level' are shown. """
+
+        return level <= self.level
+
+    def log(self, level, message="", *args):
+        """ Show 'message', formatted with 'args' as in str.format, if 'level' is enabled. """
+
+        if level <= self.level:
+            self.lines.append(message.format(*args) if args else message)
+            if len(self.lines) >= self.buffer_lines:
+                self.flush()
+
+    def flush(self):
+        """ Write the buffered lines. """
+
+        if self.lines:
+            stream = self.stream if self.stream is not None else sys.stdout
+            stream.write("\n".join(self.lines) + "\n")
+            stream.flush()
+            self.lines = []
+
+    def set_level(self, level):
+        """ Change the verbosity, writing what was buffered at the old one first. """
+
+        self.flush()
+        self.level = level
+
+
+console = Console()
+atexit.register(console.flush)
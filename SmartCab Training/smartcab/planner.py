@@ -11,7 +11,7 @@ class RoutePlanner(object):
     def route_to(self, destination=None):
         """ Select the destination if one is provided, otherwise choose a random intersection. """
 
-        self.destination = destination if destination is not None else random.choice(self.env.intersections.keys())
+        self.destination = destination if destination is not None else random.choice(self.env.locations)
 
     def next_waypoint(self):
         """ Creates the next waypoint based on current heading, location,
@@ -22,6 +22,10 @@ class RoutePlanner(object):
         location = self.env.agent_states[self.agent]['location']
         heading = self.env.agent_states[self.agent]['heading']
 
+        # Look the waypoint up if the environment has a routing table
+        if self.env.routes is not None:
+            return self.env.routes.waypoint(location, heading, self.destination)
+
         delta_a = (self.destination[0] - location[0], self.destination[1] - location[1])
         delta_b = (bounds[0] + delta_a[0] if delta_a[0] <= 0 else delta_a[0] - bounds[0], \
                    bounds[1] + delta_a[1] if delta_a[1] <= 0 else delta_a[1] - bounds[1])
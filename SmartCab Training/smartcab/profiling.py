@@ -0,0 +1,72 @@
+from timeit import default_timer
+
+# Phases of a simulation step, in report order
+phases = ['update', 'learners', 'dummies', 'lights', 'sense', 'act', 'build_state', 'choose_action', 'learn', 'render_text']
+
+
+class PhaseStats(object):
+    """ Wall time and call counts of each phase of a simulation.
+
+        Phases are measured by wrapping the methods that implement them (see
+        instrument), so nothing is timed, or slowed down, unless stats are in use.
+        Times are inclusive: 'update' (the primary agent) contains its
+        'build_state', 'choose_action', 'act' and 'learn', and 'act' contains the
+        'sense' it calls. 'learners' (additional learning agents) contains their
+        'sense' and 'act' as well. """
+
+    def __init__(self):
+        self.time = dict((phase, 0.0) for phase in phases)  # seconds, over the whole run
+        self.calls = dict((phase, 0) for phase in phases)
+        self.trial_start = dict(self.time)  # totals at the start of the current trial
+
+    def instrument(self, obj, method, phase):
+        """ Time every call of obj.'method' as 'phase', by shadowing the method with a timed
+            wrapper on the instance. """
+
+        function = getattr(obj, method)
+        time = self.time
+        calls = self.calls
+
+        def timed(*args, **kwargs):
+            start = default_timer()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                time[phase] += default_timer() - start
+                calls[phase] += 1
+
+        setattr(obj, method, timed)
+
+    def instrument_simulation(self, sim):
+        """ Instrument the phases of the simulator 'sim', its environment and primary agent. """
+
+        env = sim.env
+        self.instrument(env, 'sense', 'sense')
+        self.instrument(env, 'act', 'act')
+        self.instrument(env, '_update_learners', 'learners')
+        self.instrument(env, '_update_dummies', 'dummies')
+        self.instrument(env, '_update_lights', 'lights')
+        self.instrument(sim, 'render_text', 'render_text')
+        a = env.primary_agent
+        if a is not None:
+            for method in ['update', 'build_state', 'choose_action', 'learn']:
+                if hasattr(a, method):
+                    self.instrument(a, method, method)
+
+    def start_trial(self):
+        self.trial_start = dict(self.time)
+
+    def trial_summary(self):
+        """ Seconds spent in each phase since the start of the trial. """
+
+        return dict((phase, self.time[phase] - self.trial_start[phase]) for phase in phases)
+
+    def report(self):
+        """ A table of the time and calls of each phase, as lines of text. """
+
+        lines = ["{:>14} {:>10} {:>10} {:>10}".format("phase", "seconds", "calls", "us/call")]
+        for phase in phases:
+            calls = self.calls[phase]
+            lines.append("{:>14} {:10.3f} {:10d} {:10.1f}".format(
+                phase, self.time[phase], calls, self.time[phase] / calls * 1e6 if calls else 0.0))
+        return lines
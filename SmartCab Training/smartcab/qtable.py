@@ -0,0 +1,70 @@
+import itertools
+import numpy as np
+from records import load_records
+
+
+class StateEncoder(object):
+    """ Maps agent states (tuples with one value per feature) to dense integers.
+
+        'features' lists the possible values of each feature of the state, e.g.
+        [waypoints, lights, oncoming traffic]. States are numbered in the order
+        of itertools.product over the features. """
+
+    def __init__(self, features):
+        self.features = [list(values) for values in features]
+        self.states = list(itertools.product(*self.features))  # decoding table
+        self.index = dict((state, i) for i, state in enumerate(self.states))  # encoding table
+        self.n_states = len(self.states)
+        self.shape = tuple(len(values) for values in self.features)
+
+    def encode(self, state):
+        """ The integer code of 'state'. """
+
+        return self.index[state]
+
+    def decode(self, code):
+        """ The state with the integer 'code'. """
+
+        return self.states[code]
+
+    def value_indices(self):
+        """ The index of each feature value (in 'features') of every state, one row per state code. """
+
+        return np.array(np.unravel_index(np.arange(self.n_states), self.shape)).T
+
+    def encode_indices(self, indices):
+        """ The codes of the states with the feature value indices in the rows of 'indices'. """
+
+        return np.ravel_multi_index(np.asarray(indices).T, self.shape)
+
+
+def qtable_dtype(encoder, n_actions):
+    """ One row of a saved Q-table: the state, as the index of each of its feature values,
+        whether the state was created, and its action values. """
+
+    return np.dtype([
+        ('state', 'i1', (len(encoder.features),)),
+        ('created', '?'),
+        ('Q', '<f8', (n_actions,))
+    ])
+
+
+def save_qtable(filename, encoder, Q, created):
+    """ Save a Q-table (action values 'Q' and 'created' flags, indexed by the state codes
+        of 'encoder') as a .npy record file with one row per state code. """
+
+    table = np.zeros(encoder.n_states, dtype=qtable_dtype(encoder, Q.shape[1]))
+    table['state'] = encoder.value_indices()
+    table['created'] = created
+    table['Q'] = Q
+    np.save(filename, table)
+
+
+def load_qtable(filename, encoder, mmap=True):
+    """ Load a Q-table saved by save_qtable, memory-mapped unless 'mmap' is False.
+        Returns the state codes of its rows in 'encoder', and the table. """
+
+    table = load_records(filename, mmap)
+    if table.dtype.names != ('state', 'created', 'Q') or table['state'].shape[1:] != (len(encoder.features),):
+        raise ValueError("{} is not a Q-table of states with {} features.".format(filename, len(encoder.features)))
+    return encoder.encode_indices(table['state']), table
@@ -0,0 +1,78 @@
+import io
+import os
+import Queue
+import threading
+import zipfile
+import numpy as np
+import pygame
+from output import console, RUN
+
+
+class FrameRecorder(object):
+    """ Writes rendered frames from a background thread.
+
+        Frames go to a compressed .npz archive if 'path' ends in .npz (one
+        (height, width, 3) uint8 array per frame, by name, readable with np.load),
+        and otherwise to a sequence of PNG files in the directory 'path'.
+
+        Captured frames wait in a queue of at most 'queue_size' frames. When the
+        writer falls behind, new frames are dropped (and counted in 'dropped')
+        rather than blocking the simulation or letting memory grow. """
+
+    def __init__(self, path, queue_size=16):
+        self.path = path
+        self.archive = None
+        if path.endswith('.npz'):
+            self.archive = zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED, allowZip64=True)
+        elif not os.path.isdir(path):
+            os.makedirs(path)
+
+        self.queue = Queue.Queue(queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.error = None  # first error of the writer thread
+        self.thread = threading.Thread(target=self._write_frames, name="FrameRecorder")
+        self.thread.daemon = True
+        self.thread.start()
+
+    def capture(self, surface, name):
+        """ Queue a copy of 'surface' as the frame 'name'. Returns False if the frame was dropped. """
+
+        if self.queue.full(): # Don't copy a frame that would be dropped anyway
+            self.dropped += 1
+            return False
+        try:
+            self.queue.put_nowait((name, surface.copy()))  # pixels are converted in the writer thread
+        except Queue.Full:
+            self.dropped += 1
+            return False
+        return True
+
+    def _write_frames(self):
+        while True:
+            frame = self.queue.get()
+            if frame is None:
+                break
+            name, surface = frame
+            try:
+                if self.archive is not None:
+                    width, height = surface.get_size()
+                    f = io.BytesIO()
+                    np.lib.format.write_array(f, np.frombuffer(pygame.image.tostring(surface, 'RGB'), dtype=np.uint8).reshape(height, width, 3))
+                    self.archive.writestr(name + ".npy", f.getvalue())
+                else:
+                    pygame.image.save(surface, os.path.join(self.path, name + ".png"))
+                self.written += 1
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+
+    def close(self):
+        """ Write the queued frames and close the archive. """
+
+        self.queue.put(None)
+        self.thread.join()
+        if self.archive is not None:
+            self.archive.close()
+        if self.error is not None:
+            console.log(RUN, "FrameRecorder.close(): Error writing frames to {}.\n{}: {}", self.path, self.error.__class__.__name__, self.error)
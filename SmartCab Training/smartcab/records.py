@@ -0,0 +1,303 @@
+import os
+import csv
+import atexit
+import struct
+import Queue
+import threading
+from functools import partial
+import numpy as np
+from numpy.lib import format as npy_format
+from profiling import phases
+
+# The columns of the trial log written by Simulator with log_format='csv'
+trial_fields = ['trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
+
+# One row of the trial log written by Simulator with log_format='npy'
+trial_dtype = np.dtype([
+    ('trial', '<i4'),
+    ('testing', '?'),
+    ('epsilon', '<f8'),
+    ('alpha', '<f8'),
+    ('initial_deadline', '<i4'),
+    ('final_deadline', '<i4'),
+    ('net_reward', '<f8'),
+    ('actions', '<i4', (5,)),  # counts of each violation class, 0 (none) to 4 (major accident)
+    ('success', 'i1')
+])
+
+# A row of the learners log: the trial data of one additional learning agent (see Environment.add_learner)
+learner_trial_dtype = np.dtype([('learner', '<i4')] + trial_dtype.descr)
+
+# A trial log row with the seconds spent in each phase of profiling.phases, for profiled runs:
+# one scalar column 'profile_<phase>' per phase, so the log loads into a flat table
+profiled_trial_dtype = np.dtype(trial_dtype.descr + [('profile_' + phase, '<f8') for phase in phases])
+
+
+def header_size(dtype):
+    """ Size of the fixed .npy header of a record file of 'dtype'. It leaves room for
+        any record count, so that the count can be rewritten in place as records are appended. """
+
+    header = repr({'descr': npy_format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (10 ** 18,)})
+    return (len(npy_format.magic(1, 0)) + 2 + len(header) + 1 + 63) // 64 * 64
+
+
+def write_header(f, dtype, count):
+    """ Write the .npy (version 1.0) header of a record file with 'count' records of 'dtype'. """
+
+    header = repr({'descr': npy_format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (count,)})
+    magic = npy_format.magic(1, 0)
+    header = header.ljust(header_size(dtype) - len(magic) - 3) + '\n'
+    f.seek(0)
+    f.write(magic + struct.pack('<H', len(header)) + header)
+
+
+class RecordWriter(object):
+    """ Appends fixed-size records to a .npy file in bulk.
+
+        Records are collected in a preallocated buffer of 'chunk_size' rows and written
+        out a chunk at a time, after which the header is updated with the new record
+        count. The file is a valid .npy array after every flush and can be loaded
+        (or memory-mapped) with load_records.
+
+        With 'count' set, an existing record file is reopened and continued after
+        its first 'count' records; any records after those are discarded. """
+
+    def __init__(self, filename, dtype, chunk_size=4096, count=None):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.offset = header_size(self.dtype)
+        self.file = open(filename, 'w+b' if count is None else 'r+b')
+        self.buffer = np.zeros(chunk_size, dtype=self.dtype)
+        self.buffered = 0           # records waiting in the buffer
+        self.count = count or 0     # records written to the file
+        self.file.truncate(self.offset + self.count * self.dtype.itemsize)
+        write_header(self.file, self.dtype, self.count)
+
+    def append(self, **fields):
+        """ Add one record with the given field values. """
+
+        for name, value in fields.iteritems():
+            self.buffer[name][self.buffered] = value
+        self.buffered += 1
+        if self.buffered == len(self.buffer):
+            self.flush()
+
+    def extend(self, rows):
+        """ Add records from a list of dicts of field values. """
+
+        for row in rows:
+            self.append(**row)
+
+    def flush(self):
+        """ Write the buffered records and the new record count to the file. """
+
+        if self.buffered:
+            self.file.seek(self.offset + self.count * self.dtype.itemsize)
+            self.file.write(self.buffer[:self.buffered].tobytes())
+            self.count += self.buffered
+            self.buffered = 0
+            write_header(self.file, self.dtype, self.count)
+        self.file.flush()
+
+    def sync(self):
+        """ Flush, then make sure the records are on disk. """
+
+        self.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+
+def sync_file(f):
+    """ Flush the file object 'f' and make sure its contents are on disk. """
+
+    f.flush()
+    os.fsync(f.fileno())
+
+
+class LogSink(object):
+    """ Writes log rows in batches from a background thread.
+
+        Rows are collected in memory and handed to the writer thread 'batch_size' at a
+        time, where 'write_rows' (a function of a list of rows) writes them. At most
+        'max_batches' batches wait for the writer; when it falls that far behind,
+        write() blocks until the writer has taken a batch, so the sink never holds
+        more than (max_batches + 1) * batch_size rows.
+
+        flush() waits until every row so far is written and then calls 'sync' to make
+        them durable. The sink is also closed at interpreter exit, so rows are not lost
+        when a run is stopped by an uncaught exception such as KeyboardInterrupt. """
+
+    def __init__(self, write_rows, sync, batch_size=64, max_batches=16):
+        self.write_rows = write_rows
+        self.sync = sync
+        self.batch_size = batch_size
+        self.batch = []
+        self.queue = Queue.Queue(max_batches)
+        self.error = None  # first error of the writer thread, raised by flush()
+        self.closed = False
+        self.thread = threading.Thread(target=self._write_batches, name="LogSink")
+        self.thread.daemon = True
+        self.thread.start()
+        atexit.register(self.close)
+
+    def write(self, row):
+        """ Add one row. """
+
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.queue.put(self.batch)  # blocks while 'max_batches' batches are waiting
+            self.batch = []
+
+    def _write_batches(self):
+        while True:
+            batch = self.queue.get()
+            try:
+                if batch is not None and self.error is None:
+                    self.write_rows(batch)
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+            if batch is None:
+                break
+
+    def flush(self):
+        """ Write all rows so far and make them durable. """
+
+        if self.batch:
+            self.queue.put(self.batch)
+            self.batch = []
+        self.queue.join()
+        if self.error is not None:
+            raise self.error
+        self.sync()
+
+    def close(self):
+        """ Flush and stop the writer thread. """
+
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.flush()
+        finally:
+            self.queue.put(None)
+            self.thread.join()
+
+
+def trial_row(log_format, trial, data):
+    """ The trial log row of 'trial' from its trial data 'data' (as in Environment.trial_data),
+        for a log in 'log_format' ('csv' or 'npy'). """
+
+    if log_format == 'npy':
+        return dict(
+            trial=trial,
+            testing=data['testing'],
+            epsilon=data['parameters']['e'],
+            alpha=data['parameters']['a'],
+            initial_deadline=data['initial_deadline'],
+            final_deadline=data['final_deadline'],
+            net_reward=data['net_reward'],
+            actions=[data['actions'][k] for k in range(5)],
+            success=data['success']
+        )
+    return {
+        'trial': trial,
+        'testing': data['testing'],
+        'parameters': data['parameters'],
+        'initial_deadline': data['initial_deadline'],
+        'final_deadline': data['final_deadline'],
+        'net_reward': data['net_reward'],
+        'actions': data['actions'],
+        'success': data['success']
+    }
+
+
+def open_trial_log(filename, log_format, dtype, fields, position=None):
+    """ Open a trial log in 'log_format': records of 'dtype' for 'npy', or a CSV with the
+        columns 'fields'. With 'position' set (a record count for 'npy', a byte offset for
+        'csv'), the existing log is continued there. Returns the file and a LogSink
+        that writes rows to it in batches from a background thread. """
+
+    if log_format == 'npy':
+        log_file = RecordWriter(filename, dtype, count=position)
+        return log_file, LogSink(log_file.extend, log_file.sync)
+
+    if position is not None:
+        log_file = open(filename, 'r+b')
+        log_file.truncate(position)
+        log_file.seek(0, os.SEEK_END)
+        log_writer = csv.DictWriter(log_file, fieldnames=fields)
+    else:
+        log_file = open(filename, 'wb')
+        log_writer = csv.DictWriter(log_file, fieldnames=fields)
+        log_writer.writeheader()
+    return log_file, LogSink(log_writer.writerows, partial(sync_file, log_file))
+
+
+def load_records(filename, mmap=True):
+    """ Load a record file, memory-mapped (read-only) unless 'mmap' is False. """
+
+    return np.load(filename, mmap_mode='r' if mmap else None)
+
+
+class MappedRecordFile(object):
+    """ A .npy record file that is written through a memory map.
+
+        Space for 'chunk_size' records is preallocated at a time and the file grows
+        by another chunk whenever it fills up. Records are written straight into the
+        map, and the header holds the number of records as of the last flush.
+
+        With 'count' set, an existing record file is reopened and continued after
+        its first 'count' records; any records after those are discarded. """
+
+    def __init__(self, filename, dtype, chunk_size=65536, count=None):
+        self.filename = filename
+        self.dtype = np.dtype(dtype)
+        self.offset = header_size(self.dtype)
+        self.chunk_size = chunk_size
+        self.count = count or 0
+        self.capacity = (self.count // chunk_size) * chunk_size  # _grow adds the chunk holding the next record
+        self.map = None
+        with open(filename, 'w+b' if count is None else 'r+b') as f:
+            f.truncate(self.offset + self.count * self.dtype.itemsize)
+            write_header(f, self.dtype, self.count)
+        self._grow()
+
+    def _grow(self):
+        """ Extend the file by one chunk and map it again. """
+
+        if self.map is not None:
+            self.map.flush()
+            del self.map
+        self.capacity += self.chunk_size
+        with open(self.filename, 'r+b') as f:
+            f.truncate(self.offset + self.capacity * self.dtype.itemsize)
+        self.map = np.memmap(self.filename, dtype=self.dtype, mode='r+', offset=self.offset, shape=(self.capacity,))
+
+    def append(self, record):
+        """ Add one record, a tuple of field values in the order of the dtype. """
+
+        if self.count == self.capacity:
+            self._grow()
+        self.map[self.count] = record
+        self.count += 1
+
+    def flush(self):
+        """ Write the record count to the header and the mapped records to disk. """
+
+        self.map.flush()
+        with open(self.filename, 'r+b') as f:
+            write_header(f, self.dtype, self.count)
+
+    def close(self):
+        """ Flush, then trim the unused preallocated space from the file. """
+
+        self.flush()
+        del self.map
+        self.map = None
+        with open(self.filename, 'r+b') as f:
+            f.truncate(self.offset + self.count * self.dtype.itemsize)
@@ -0,0 +1,43 @@
+import numpy as np
+
+
+class ReplayBuffer(object):
+    """ A fixed-size ring buffer of transitions (state code, action index, reward) in arrays.
+        Once it is full, each new transition replaces the oldest one. """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.state = np.zeros(capacity, dtype=np.int32)
+        self.action = np.zeros(capacity, dtype=np.int8)
+        self.reward = np.zeros(capacity)
+        self.position = 0  # slot of the next transition
+        self.size = 0      # transitions held
+
+    def add(self, state, action, reward):
+        i = self.position
+        self.state[i] = state
+        self.action[i] = action
+        self.reward[i] = reward
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        """ 'batch_size' transitions drawn uniformly (with replacement) as arrays of
+            states, actions and rewards. Uses NumPy's global random state. """
+
+        i = np.random.randint(self.size, size=batch_size)
+        return self.state[i], self.action[i], self.reward[i]
+
+
+def batch_update(Q, states, actions, rewards, alpha):
+    """ Apply the LearningAgent update Q[s, a] = (1 - alpha) * Q[s, a] + alpha * reward
+        for a minibatch of transitions at once. The rewards of transitions with the
+        same (state, action) are averaged into one update, so the result does not
+        depend on their order in the batch. """
+
+    values = Q.reshape(-1)  # a view of the (contiguous) table
+    pairs = states.astype(np.int64) * Q.shape[1] + actions
+    counts = np.bincount(pairs, minlength=values.size)
+    totals = np.bincount(pairs, weights=rewards, minlength=values.size)
+    hit = np.flatnonzero(counts)
+    values[hit] = (1 - alpha) * values[hit] + alpha * totals[hit] / counts[hit]
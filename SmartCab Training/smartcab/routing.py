@@ -0,0 +1,59 @@
+import random
+import numpy as np
+from vecenv import plan_waypoints
+
+
+class RoutingTable(object):
+    """ Precomputed routes of a wrap-around grid of 'grid_size' (columns, rows),
+        with intersections at 'bounds' as in Environment.
+
+        On a wrap-around grid the waypoint only depends on the destination delta
+        (destination - location) and the heading, and the distance only on the
+        delta, so both are stored per delta: O(columns * rows) integers instead
+        of one entry per (location, heading, destination). """
+
+    def __init__(self, grid_size, bounds, valid_actions, valid_headings, min_distance=4):
+        self.columns, self.rows = grid_size
+        self.origin = bounds[:2]
+        self.valid_actions = valid_actions
+        self.heading_index = dict((heading, i) for i, heading in enumerate(valid_headings))
+
+        # Next waypoint (index in 'valid_actions') by delta x, delta y and heading index,
+        # with the deltas shifted by (columns - 1, rows - 1)
+        delta_x, delta_y, heading = np.meshgrid(np.arange(1 - self.columns, self.columns), np.arange(1 - self.rows, self.rows),
+                                                np.arange(len(valid_headings)), indexing='ij')
+        self.waypoints = plan_waypoints(delta_x, delta_y, heading, grid_size)
+
+        # Wrap-around L1 distance by delta x and delta y (shifted as above)
+        dx = np.abs(np.arange(1 - self.columns, self.columns))
+        dy = np.abs(np.arange(1 - self.rows, self.rows))
+        self.distances = (np.minimum(dx, self.columns - dx)[:, None] + np.minimum(dy, self.rows - dy)[None, :]).astype(np.int32)
+
+        # Offsets (modulo the grid) from a start to the destinations at least 'min_distance' away
+        self.offset_x, self.offset_y = [offsets.astype(np.int32) for offsets in
+                                        np.nonzero(self.distances[self.columns - 1:, self.rows - 1:] >= min_distance)]
+        if not len(self.offset_x):
+            raise ValueError("No destinations are {} or more intersections apart on a {} grid.".format(min_distance, grid_size))
+
+    def waypoint(self, location, heading, destination):
+        """ The next waypoint from 'location' with 'heading' to 'destination' (as RoutePlanner.next_waypoint). """
+
+        return self.valid_actions[self.waypoints.item(destination[0] - location[0] + self.columns - 1,
+                                                      destination[1] - location[1] + self.rows - 1,
+                                                      self.heading_index[heading])]
+
+    def distance(self, a, b):
+        """ The wrap-around L1 distance from 'a' to 'b' (as Environment.compute_dist). """
+
+        return self.distances.item(b[0] - a[0] + self.columns - 1, b[1] - a[1] + self.rows - 1)
+
+    def sample_trip(self):
+        """ A random start and destination at least 'min_distance' apart, uniform over all such pairs. """
+
+        x = random.randrange(self.columns)
+        y = random.randrange(self.rows)
+        i = random.randrange(len(self.offset_x))
+        start = (x + self.origin[0], y + self.origin[1])
+        destination = ((x + self.offset_x.item(i)) % self.columns + self.origin[0],
+                       (y + self.offset_y.item(i)) % self.rows + self.origin[1])
+        return start, destination
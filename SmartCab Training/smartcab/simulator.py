@@ -9,7 +9,55 @@ import os
 import time
 import random
 import importlib
-import csv
+from timeit import default_timer
+from records import open_trial_log, trial_row, trial_fields, trial_dtype, profiled_trial_dtype, learner_trial_dtype
+from profiling import PhaseStats, phases
+from output import console, RUN, TRIAL, STEP
+from checkpoint import save_checkpoint, load_checkpoint, restore
+
+
+def describe_step(status, enforce_deadline):
+    """ Describe the result of a step of the primary agent, given its step data
+        ('status'), as the lines of text shown in the terminal. """
+
+    lines = []
+
+    # Previous State
+    if status['state']:
+        lines.append("Agent previous state: {}".format(status['state']))
+    else:
+        lines.append("!! Agent state not been updated!")
+
+    # Result
+    if status['violation'] == 0: # Legal
+        if status['waypoint'] == status['action']: # Followed waypoint
+            lines.append("Agent followed the waypoint {}. (rewarded {:.2f})".format(status['action'], status['reward']))
+        elif status['action'] == None:
+            if status['light'] == 'red': # Stuck at red light
+                lines.append("Agent properly idled at a red light. (rewarded {:.2f})".format(status['reward']))
+            else:
+                lines.append("Agent idled at a green light with oncoming traffic. (rewarded {:.2f})".format(status['reward']))
+        else: # Did not follow waypoint
+            lines.append("Agent drove {} instead of {}. (rewarded {:.2f})".format(status['action'], status['waypoint'], status['reward']))
+    else: # Illegal
+        if status['violation'] == 1: # Minor violation
+            lines.append("Agent idled at a green light with no oncoming traffic. (rewarded {:.2f})".format(status['reward']))
+        elif status['violation'] == 2: # Major violation
+            lines.append("Agent attempted driving {} through a red light. (rewarded {:.2f})".format(status['action'], status['reward']))
+        elif status['violation'] == 3: # Minor accident
+            lines.append("Agent attempted driving {} through traffic and cause a minor accident. (rewarded {:.2f})".format(status['action'], status['reward']))
+        elif status['violation'] == 4: # Major accident
+            lines.append("Agent attempted driving {} through a red light with traffic and cause a major accident. (rewarded {:.2f})".format(status['action'], status['reward']))
+
+    # Time Remaining
+    if enforce_deadline:
+        remaining = (status['deadline'] - 1) * 100.0 / (status['t'] + status['deadline'])
+        lines.append("{:.0f}% of time remaining to reach destination.".format(remaining))
+    else:
+        lines.append("Agent not enforced to meet deadline.")
+
+    return lines
+
 
 class Simulator(object):
     """Simulates agents in a dynamic smartcab environment.
@@ -34,7 +82,9 @@ class Simulator(object):
         'gray'    : (155, 155, 155)
     }
 
-    def __init__(self, env, size=None, update_delay=2.0, display=True, log_metrics=False, optimized=False):
+    def __init__(self, env, size=None, update_delay=2.0, display=True, log_metrics=False, optimized=False, fast=False, log_format='csv',
+                 trace=None, checkpoint=None, checkpoint_every=100, resume=False, record=None, record_trials=None, frame_skip=0,
+                 profile=False):
         self.env = env
         self.size = size if size is not None else ((self.env.grid_size[0] + 1) * self.env.block_size, (self.env.grid_size[1] + 2) * self.env.block_size)
         self.width, self.height = self.size
@@ -52,8 +102,21 @@ class Simulator(object):
         self.last_updated = 0.0
         self.update_delay = update_delay  # duration between each step (in seconds)
 
-        self.display = display
-        if self.display:
+        # Headless mode: step on a simulated clock as fast as possible
+        self.fast = fast
+        self.throughput = None  # steps and trials per second of the last fast run
+
+        self.display = display and not self.fast
+
+        # Offscreen rendering: without a display, recorded frames are rendered with SDL's dummy video driver
+        self.record = record  # directory for a PNG sequence, or a .npz frame archive
+        self.record_trials = record_trials  # trials to record (counted over the whole run), all if None
+        self.frame_skip = frame_skip  # steps skipped between recorded frames
+        self.recorder = None
+        if self.record is not None and not self.display:
+            os.environ['SDL_VIDEODRIVER'] = 'dummy'
+
+        if self.display or self.record is not None:
             try:
                 self.pygame = importlib.import_module('pygame')
                 self.pygame.init()
@@ -73,19 +136,50 @@ class Simulator(object):
                     else:
                         agent._sprite = self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(agent.color))), self.agent_sprite_size)
                     agent._sprite_size = (agent._sprite.get_width(), agent._sprite.get_height())
+                    agent._sprites = self.rotate_sprite(agent._sprite)
+                if self.env.traffic is not None: # One sprite per color for the dummies of the traffic engine
+                    self._traffic_sprites = dict((color, self.rotate_sprite(self.pygame.transform.smoothscale(self.pygame.image.load(os.path.join("images", "car-{}.png".format(color))), self.agent_sprite_size)))
+                                                 for color in self.env.traffic.color_choices)
+
+                # Fonts are built once, by size
+                self.fonts = dict((size, self.pygame.font.Font(None, size)) for size in (20, 22, 30, 40, 50))
+                self.font = self.fonts[20]
 
-                self.font = self.pygame.font.Font(None, 20)
+                # The static map is drawn once; frames start from a copy of it
+                self.draw_background()
                 self.paused = False
+
+                if self.record is not None:
+                    from recorder import FrameRecorder
+                    self.recorder = FrameRecorder(self.record)
             except ImportError as e:
                 self.display = False
-                print "Simulator.__init__(): Unable to import pygame; display disabled.\n{}: {}".format(e.__class__.__name__, e)
+                self.record = None
+                console.log(RUN, "Simulator.__init__(): Unable to import pygame; display and recording disabled.\n{}: {}", e.__class__.__name__, e)
             except Exception as e:
                 self.display = False
-                print "Simulator.__init__(): Error initializing GUI objects; display disabled.\n{}: {}".format(e.__class__.__name__, e)
+                self.record = None
+                console.log(RUN, "Simulator.__init__(): Error initializing GUI objects; display and recording disabled.\n{}: {}", e.__class__.__name__, e)
+
+        # Checkpoints of the run, taken every 'checkpoint_every' trials, to resume it after a crash
+        self.checkpoint = checkpoint
+        self.checkpoint_every = checkpoint_every
+        self.resume_state = None
+        if resume and self.checkpoint is not None and os.path.exists(self.checkpoint):
+            self.resume_state = load_checkpoint(self.checkpoint)
+
+        # Time spent in each phase of a step, also logged per trial (see profiling.PhaseStats)
+        self.stats = None
+        if profile:
+            self.stats = PhaseStats()
+            self.stats.instrument_simulation(self)
+            self.env.stats = self.stats
 
         # Setup metrics to report
         self.log_metrics = log_metrics
+        self.learners_log_file = None  # the log of the learners, if the environment has any
         self.optimized = optimized
+        self.log_format = log_format  # 'csv' for stringified dicts, 'npy' for typed columns
         
         if self.log_metrics:
             a = self.env.primary_agent
@@ -95,26 +189,44 @@ class Simulator(object):
                 if self.optimized: # Whether the user is optimizing the parameters and decay functions
                     self.log_filename = os.path.join("logs", "sim_improved-learning.csv")
                     self.table_filename = os.path.join("logs","sim_improved-learning.txt")
+                    self.Q_filename = os.path.join("logs", "sim_improved-learning_Q.npy")
                 else: 
                     self.log_filename = os.path.join("logs", "sim_default-learning.csv")
                     self.table_filename = os.path.join("logs","sim_default-learning.txt")
+                    self.Q_filename = os.path.join("logs", "sim_default-learning_Q.npy")
 
                 self.table_file = open(self.table_filename, 'wb')
             else:
                 self.log_filename = os.path.join("logs", "sim_no-learning.csv")
             
-            self.log_fields = ['trial', 'testing', 'parameters', 'initial_deadline', 'final_deadline', 'net_reward', 'actions', 'success']
-            self.log_file = open(self.log_filename, 'wb')
-            self.log_writer = csv.DictWriter(self.log_file, fieldnames=self.log_fields)
-            self.log_writer.writeheader()
-
-    def run(self, tolerance=0.05, n_test=0):
+            if self.log_format == 'npy':
+                self.log_filename = os.path.splitext(self.log_filename)[0] + ".npy"
+            self.log_fields = trial_fields + (['profile'] if self.stats is not None else [])
+            self.log_file, self.log_sink = self.open_log(self.log_filename, profiled_trial_dtype if self.stats is not None else trial_dtype,
+                                                         self.log_fields, 'log_position')
+
+            # One row per learner and trial, next to the trial log
+            if self.env.learners:
+                self.learners_log_filename = "{0[0]}_learners{0[1]}".format(os.path.splitext(self.log_filename))
+                self.learners_log_file, self.learners_log_sink = self.open_log(self.learners_log_filename, learner_trial_dtype,
+                                                                               ['learner'] + trial_fields, 'learners_log_position')
+
+        # Record every step of the primary agent to the file 'trace'
+        self.trace = None
+        if trace is not None:
+            from steptrace import TraceRecorder
+            count = None
+            if self.resume_state is not None and int(self.resume_state.get('trace_count', -1)) >= 0: # Continue the trace after the steps of the checkpoint
+                count = int(self.resume_state['trace_count'])
+            self.trace = TraceRecorder(trace, encoder=getattr(self.env.primary_agent, 'encoder', None), count=count)
+            self.env.trace = self.trace
+
+    def run(self, tolerance=0.05, n_test=0, min_train=20):
         """ Run a simulation of the environment. 
 
         'tolerance' is the minimum epsilon necessary to begin testing (if enabled)
         'n_test' is the number of testing trials simulated
-
-        Note that the minimum number of training trials is always 20. """
+        'min_train' is the minimum number of training trials, 20 by default """
 
         self.quit = False
 
@@ -125,11 +237,21 @@ class Simulator(object):
         testing = False
         trial = 1
 
+        total_steps = 0
+        run_start = default_timer()
+
+        # Continue from the checkpoint
+        if self.resume_state is not None:
+            total_trials, testing, trial = restore(self, self.resume_state)
+            self.resume_state = None
+            console.log(RUN, "Simulator.run(): Resuming from {} at trial {}.", self.checkpoint, total_trials)
+        first_trial = total_trials
+
         while True:
 
             # Flip testing switch
             if not testing:
-                if total_trials > 20: # Must complete minimum 20 training trials
+                if total_trials > min_train: # Must complete minimum 'min_train' training trials
                     if a.learning:
                         if a.epsilon < tolerance: # assumes epsilon decays to 0
                             testing = True
@@ -144,21 +266,34 @@ class Simulator(object):
                     break
 
             # Pretty print to terminal
-            print 
-            print "/-------------------------"
             if testing:
-                print "| Testing trial {}".format(trial)
+                console.log(TRIAL, "\n/-------------------------\n| Testing trial {}\n\-------------------------\n", trial)
             else:
-                print "| Training trial {}".format(trial)
-
-            print "\-------------------------"
-            print 
+                console.log(TRIAL, "\n/-------------------------\n| Training trial {}\n\-------------------------\n", trial)
 
             self.env.reset(testing)
             self.current_time = 0.0
             self.last_updated = 0.0
-            self.start_time = time.time()
-            while True:
+            recording = self.recorder is not None and (self.record_trials is None or total_trials in self.record_trials)
+            if self.stats is not None:
+                self.stats.start_trial()
+
+            # Step as fast as possible, advancing the simulated clock by 'update_delay'
+            if self.fast:
+                try:
+                    while not self.env.done:
+                        self.env.step()
+                        self.current_time += self.update_delay
+                        self.last_updated = self.current_time
+                        total_steps += 1
+                        if recording:
+                            self.record_frame(total_trials, trial, testing)
+                except KeyboardInterrupt:
+                    self.quit = True
+            else:
+                self.start_time = time.time()
+
+            while not self.fast:
                 try:
                     # Update current time
                     self.current_time = time.time() - self.start_time
@@ -181,9 +316,12 @@ class Simulator(object):
                     if self.current_time - self.last_updated >= self.update_delay:
                         self.env.step()
                         self.last_updated = self.current_time
+                        if recording:
+                            self.record_frame(total_trials, trial, testing)
                     
                     # Render text
                     self.render_text(trial, testing)
+                    console.flush()
 
                     # Render GUI and sleep
                     if self.display:
@@ -200,55 +338,115 @@ class Simulator(object):
                 break
 
             # Collect metrics from trial
-            if self.log_metrics:
-                self.log_writer.writerow({
-                    'trial': trial,
-                    'testing': self.env.trial_data['testing'],
-                    'parameters': self.env.trial_data['parameters'],
-                    'initial_deadline': self.env.trial_data['initial_deadline'],
-                    'final_deadline': self.env.trial_data['final_deadline'],
-                    'net_reward': self.env.trial_data['net_reward'],
-                    'actions': self.env.trial_data['actions'],
-                    'success': self.env.trial_data['success']
-                })
+            self.log_trial(trial)
+            if self.trace is not None:
+                self.trace.flush()
 
             # Trial finished
             if self.env.success == True:
-                print "\nTrial Completed!"
-                print "Agent reached the destination."
+                console.log(TRIAL, "\nTrial Completed!\nAgent reached the destination.")
             else:
-                print "\nTrial Aborted!"
-                print "Agent did not reach the destination."
+                console.log(TRIAL, "\nTrial Aborted!\nAgent did not reach the destination.")
+            if self.env.learners:
+                console.log(TRIAL, "{} of {} learners reached their destination.",
+                    sum(data['success'] for data in self.env.learners.itervalues()), len(self.env.learners))
+            console.flush()
 
             # Increment
             total_trials = total_trials + 1
             trial = trial + 1
 
+            # Checkpoint
+            if self.checkpoint is not None and (total_trials - 1) % self.checkpoint_every == 0:
+                save_checkpoint(self.checkpoint, self, (total_trials, testing, trial))
+
         # Clean up
         if self.log_metrics:
 
             if a.learning:
-                f = self.table_file
-                
-                f.write("/-----------------------------------------\n")
-                f.write("| State-action rewards from Q-Learning\n")
-                f.write("\-----------------------------------------\n\n")
-
-                for state in a.Q:
-                    f.write("{}\n".format(state))
-                    for action, reward in a.Q[state].iteritems():
-                        f.write(" -- {} : {:.2f}\n".format(action, reward))
-                    f.write("\n")  
+                # Build the whole table first and write it at once
+                lines = ["/-----------------------------------------\n",
+                         "| State-action rewards from Q-Learning\n",
+                         "\-----------------------------------------\n\n"]
+
+                for s in a.Q_created.nonzero()[0]:
+                    lines.append("{}\n".format(a.encoder.decode(s)))
+                    for action, reward in zip(a.valid_actions, a.Q[s]):
+                        lines.append(" -- {} : {:.2f}\n".format(action, reward))
+                    lines.append("\n")
+                self.table_file.write("".join(lines))
                 self.table_file.close()
+                a.save_Q(self.Q_filename)
 
+            self.log_sink.close()
             self.log_file.close()
-
-        print "\nSimulation ended. . . "
+            if self.learners_log_file is not None:
+                self.learners_log_sink.close()
+                self.learners_log_file.close()
+
+        if self.trace is not None:
+            self.trace.close()
+            self.env.trace = None
+
+        if self.recorder is not None:
+            self.recorder.close()
+            console.log(RUN, "Recorded {} frames to {} ({} dropped).", self.recorder.written, self.record, self.recorder.dropped)
+            self.recorder = None
+
+        console.log(RUN, "\nSimulation ended. . . ")
+
+        if self.stats is not None and console.enabled(RUN):
+            console.log(RUN, "\nTime per phase:")
+            for line in self.stats.report():
+                console.log(RUN, line)
+
+        if self.fast:
+            seconds = default_timer() - run_start
+            self.throughput = {
+                'steps': total_steps,
+                'trials': total_trials - first_trial,
+                'seconds': seconds,
+                'steps_per_sec': total_steps / seconds if seconds > 0 else float('inf'),
+                'trials_per_sec': (total_trials - first_trial) / seconds if seconds > 0 else float('inf')
+            }
+            console.log(RUN, "Simulated {} steps in {} trials ({:.2f} seconds): {:.1f} steps/sec, {:.1f} trials/sec",
+                total_steps, total_trials - first_trial, seconds, self.throughput['steps_per_sec'], self.throughput['trials_per_sec'])
+
+        console.flush()
 
         # Report final metrics
-        if self.display:
+        if self.display or self.record is not None:
             self.pygame.display.quit()  # shut down pygame
 
+    def log_trial(self, trial):
+        """ Write the metrics of the trial that just finished to the log. """
+
+        if not self.log_metrics:
+            return
+        row = trial_row(self.log_format, trial, self.env.trial_data)
+        if self.stats is not None:
+            if self.log_format == 'npy':
+                summary = self.stats.trial_summary()
+                row.update(('profile_' + phase, summary[phase]) for phase in phases)
+            else:
+                row['profile'] = dict((phase, round(seconds, 6)) for phase, seconds in self.stats.trial_summary().iteritems())
+        self.log_sink.write(row)
+
+        if self.learners_log_file is not None:
+            for i, data in enumerate(self.env.learners.itervalues()):
+                row = trial_row(self.log_format, trial, data)
+                row['learner'] = i
+                self.learners_log_sink.write(row)
+
+    def open_log(self, filename, dtype, fields, position_key):
+        """ Open a trial log (see records.open_trial_log). When resuming, the log is
+            continued after the position saved in the checkpoint under 'position_key'. """
+
+        position = None
+        if self.resume_state is not None: # Continue the log after the trials of the checkpoint
+            position = int(self.resume_state[position_key])
+        return open_trial_log(filename, self.log_format, dtype, fields, position)
+
     def render_text(self, trial, testing=False):
         """ This is the non-GUI render display of the simulation. 
             Simulated trial data will be rendered in the terminal/command prompt. """
@@ -256,105 +454,48 @@ class Simulator(object):
         status = self.env.step_data
         if status and status['waypoint'] is not None: # Continuing the trial
 
-            # Previous State
-            if status['state']:
-                print "Agent previous state: {}".format(status['state'])
-            else:
-                print "!! Agent state not been updated!"
-
-            # Result
-            if status['violation'] == 0: # Legal
-                if status['waypoint'] == status['action']: # Followed waypoint
-                    print "Agent followed the waypoint {}. (rewarded {:.2f})".format(status['action'], status['reward'])
-                elif status['action'] == None:
-                    if status['light'] == 'red': # Stuck at red light
-                        print "Agent properly idled at a red light. (rewarded {:.2f})".format(status['reward'])
-                    else:
-                        print "Agent idled at a green light with oncoming traffic. (rewarded {:.2f})".format(status['reward'])
-                else: # Did not follow waypoint
-                    print "Agent drove {} instead of {}. (rewarded {:.2f})".format(status['action'], status['waypoint'], status['reward'])
-            else: # Illegal
-                if status['violation'] == 1: # Minor violation
-                    print "Agent idled at a green light with no oncoming traffic. (rewarded {:.2f})".format(status['reward'])
-                elif status['violation'] == 2: # Major violation
-                    print "Agent attempted driving {} through a red light. (rewarded {:.2f})".format(status['action'], status['reward'])
-                elif status['violation'] == 3: # Minor accident
-                    print "Agent attempted driving {} through traffic and cause a minor accident. (rewarded {:.2f})".format(status['action'], status['reward'])
-                elif status['violation'] == 4: # Major accident
-                    print "Agent attempted driving {} through a red light with traffic and cause a major accident. (rewarded {:.2f})".format(status['action'], status['reward'])
-           
-            # Time Remaining
-            if self.env.enforce_deadline:
-                time = (status['deadline'] - 1) * 100.0 / (status['t'] + status['deadline'])
-                print "{:.0f}% of time remaining to reach destination.".format(time)
-            else:
-                print "Agent not enforced to meet deadline."
+            if console.enabled(STEP):
+                for line in describe_step(status, self.env.enforce_deadline):
+                    console.log(STEP, line)
 
         # Starting new trial
         else:
             a = self.env.primary_agent
-            print "Simulating trial. . . "
+            console.log(STEP, "Simulating trial. . . ")
             if a.learning:
-                print "espilon = {:.4f}; alpha = {:.4f}".format(a.epsilon, a.alpha)
+                console.log(STEP, "espilon = {:.4f}; alpha = {:.4f}", a.epsilon, a.alpha)
             else:
-                print "Agent not set to learn."
+                console.log(STEP, "Agent not set to learn.")
 
                 
+    def record_frame(self, total_trials, trial, testing=False):
+        """ Render the step that was just taken and queue it for the frame recorder,
+            every 'frame_skip' + 1 steps of a trial. """
+
+        step = self.env.t - 1
+        if step % (self.frame_skip + 1) == 0:
+            self.render(trial, testing)
+            self.recorder.capture(self.screen, "trial{:05d}_step{:04d}".format(total_trials, step))
+
     def render(self, trial, testing=False):
         """ This is the GUI render display of the simulation. 
             Supplementary trial data can be found from render_text. """
         
-        # Reset the screen.
-        self.screen.fill(self.bg_color)
+        # Reset the screen to the static map
+        self.screen.blit(self._background, (0, 0))
 
-        # Draw elements
-        # * Static elements
+        # Traffic lights: one pre-rendered tile per intersection
+        light_state = self.env.lights.state
+        for corner, light, ns_tile, ew_tile in self._light_tiles:
+            self.screen.blit(ns_tile if light_state[light] else ew_tile, corner)
 
-        # Boundary
-        self.pygame.draw.rect(self.screen, self.boundary, ((self.env.bounds[0] - self.env.hang)*self.env.block_size, (self.env.bounds[1]-self.env.hang)*self.env.block_size, (self.env.bounds[2] + self.env.hang/3)*self.env.block_size, (self.env.bounds[3] - 1 + self.env.hang/3)*self.env.block_size), 4)
-        
-        for road in self.env.roads:
-            # Road
-            self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
-            # Center line
-            self.pygame.draw.line(self.screen, self.line_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), 2)
-        
-        for intersection, traffic_light in self.env.intersections.iteritems():
-            self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), self.road_width/2)
-            
-            if traffic_light.state: # North-South is open
-                self.screen.blit(self._ns,
-                    self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2), 2)
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size + self.road_width/2), 2)            
-            else:
-                self.screen.blit(self._ew,
-                    self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), 2)
-                self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), 2)            
-            
         # * Dynamic elements
-        self.font = self.pygame.font.Font(None, 20)
-        for agent, state in self.env.agent_states.iteritems():
-            # Compute precise agent location here (back from the intersection some)
-            agent_offset = (2 * state['heading'][0] * self.agent_circle_radius + self.agent_circle_radius * state['heading'][1] * 0.5, \
-                            2 * state['heading'][1] * self.agent_circle_radius - self.agent_circle_radius * state['heading'][0] * 0.5)
-
+        if self.env.traffic is not None:
+            for location, heading, color in self.env.traffic.positions():
+                self.draw_agent(location, heading, color, self._traffic_sprites[color])
 
-            agent_pos = (state['location'][0] * self.env.block_size - agent_offset[0], state['location'][1] * self.env.block_size - agent_offset[1])
-            agent_color = self.colors[agent.color]
-
-            if hasattr(agent, '_sprite') and agent._sprite is not None:
-                # Draw agent sprite (image), properly rotated
-                rotated_sprite = agent._sprite if state['heading'] == (1, 0) else self.pygame.transform.rotate(agent._sprite, 180 if state['heading'][0] == -1 else state['heading'][1] * -90)
-                self.screen.blit(rotated_sprite,
-                    self.pygame.rect.Rect(agent_pos[0] - agent._sprite_size[0] / 2, agent_pos[1] - agent._sprite_size[1] / 2,
-                        agent._sprite_size[0], agent._sprite_size[1]))
-            else:
-                # Draw simple agent (circle with a short line segment poking out to indicate heading)
-                self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
-                self.pygame.draw.line(self.screen, agent_color, agent_pos, state['location'], self.road_width)
-            
+        for agent, state in self.env.agent_states.iteritems():
+            self.draw_agent(state['location'], state['heading'], agent.color, getattr(agent, '_sprites', None))
 
             if state['destination'] is not None:
                 self.screen.blit(self._logo,
@@ -364,13 +505,13 @@ class Simulator(object):
                         state['destination'][1]*self.env.block_size + self.road_width/2))
 
         # * Overlays
-        self.font = self.pygame.font.Font(None, 50)
+        self.font = self.fonts[50]
         if testing:
             self.screen.blit(self.font.render("Testing Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10))
         else:
             self.screen.blit(self.font.render("Training Trial %s"%(trial), True, self.colors['black'], self.bg_color), (10, 10))
 
-        self.font = self.pygame.font.Font(None, 30)
+        self.font = self.fonts[30]
 
         # Status text about each step
         status = self.env.step_data
@@ -423,37 +564,118 @@ class Simulator(object):
                 self.screen.blit(self.font.render("Agent not enforced to meet deadline.", True, self.colors['black'], self.bg_color), (350, 100))
             
             # Denote whether a trial was a success or failure
+            state = self.env.agent_states[self.env.primary_agent]  # not the last agent drawn: learners come after it
             if (state['destination'] != state['location'] and state['deadline'] > 0) or (self.env.enforce_deadline is not True and state['destination'] != state['location']):
-                self.font = self.pygame.font.Font(None, 40)
+                self.font = self.fonts[40]
                 if self.env.success == True:
                     self.screen.blit(self.font.render("Previous Trial: Success", True, self.colors['dgreen'], self.bg_color), (10, 50))
                 if self.env.success == False:
                     self.screen.blit(self.font.render("Previous Trial: Failure", True, self.colors['maroon'], self.bg_color), (10, 50))
 
                 if self.env.primary_agent.learning:
-                    self.font = self.pygame.font.Font(None, 22)
+                    self.font = self.fonts[22]
                     self.screen.blit(self.font.render("epsilon = {:.4f}".format(self.env.primary_agent.epsilon), True, self.colors['black'], self.bg_color), (10, 80))
                     self.screen.blit(self.font.render("alpha = {:.4f}".format(self.env.primary_agent.alpha), True, self.colors['black'], self.bg_color), (10, 95))
 
         # Reset status text
         else:
             self.pygame.rect.Rect(350, 10, self.width, 200)
-            self.font = self.pygame.font.Font(None, 40)
+            self.font = self.fonts[40]
             self.screen.blit(self.font.render("Simulating trial. . .", True, self.colors['white'], self.bg_color), (400, 60))
 
 
         # Flip buffers
         self.pygame.display.flip()
 
+    def draw_background(self):
+        """ Pre-render the static map: the boundary, roads and intersections, and a tile of each
+            intersection with its light in either state (the light image and stop lines). """
+
+        self._background = self.pygame.Surface(self.size).convert()
+        screen, self.screen = self.screen, self._background
+
+        # Reset the screen.
+        self.screen.fill(self.bg_color)
+
+        # Draw elements
+        # * Static elements
+
+        # Boundary
+        self.pygame.draw.rect(self.screen, self.boundary, ((self.env.bounds[0] - self.env.hang)*self.env.block_size, (self.env.bounds[1]-self.env.hang)*self.env.block_size, (self.env.bounds[2] + self.env.hang/3)*self.env.block_size, (self.env.bounds[3] - 1 + self.env.hang/3)*self.env.block_size), 4)
+        
+        for road in self.env.roads:
+            # Road
+            self.pygame.draw.line(self.screen, self.road_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), self.road_width)
+            # Center line
+            self.pygame.draw.line(self.screen, self.line_color, (road[0][0] * self.env.block_size, road[0][1] * self.env.block_size), (road[1][0] * self.env.block_size, road[1][1] * self.env.block_size), 2)
+
+        for intersection in self.env.locations:
+            self.pygame.draw.circle(self.screen, self.road_color, (intersection[0] * self.env.block_size, intersection[1] * self.env.block_size), self.road_width/2)
+
+        # Light tiles of each intersection, cut from copies of the map so they cover it exactly
+        # (stop lines reach 2 pixels past the light image)
+        margin = 2
+        tile_size = (self.road_width + 2 * margin + 1, self.road_width + 2 * margin + 1)
+        corners = [(intersection[0] * self.env.block_size - self.road_width/2 - margin, intersection[1] * self.env.block_size - self.road_width/2 - margin)
+                   for intersection in self.env.locations]
+        tiles = {}
+        for ns_open in (True, False):
+            self.screen = self._background.copy()
+            for intersection in self.env.locations:
+                if ns_open: # North-South is open
+                    self.screen.blit(self._ns,
+                        self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
+                    self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2), 2)
+                    self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2 + 1, intersection[1] * self.env.block_size + self.road_width/2), 2)
+                else:
+                    self.screen.blit(self._ew,
+                        self.pygame.rect.Rect(intersection[0]*self.env.block_size - self.road_width/2, intersection[1]*self.env.block_size - self.road_width/2, intersection[0]*self.env.block_size + self.road_width, intersection[1]*self.env.block_size + self.road_width/2))
+                    self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size - self.road_width/2), 2)
+                    self.pygame.draw.line(self.screen, self.stop_color, (intersection[0] * self.env.block_size + self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), (intersection[0] * self.env.block_size - self.road_width/2, intersection[1] * self.env.block_size + self.road_width/2 + 1), 2)
+            tiles[ns_open] = [self.screen.subsurface(self.pygame.rect.Rect(corner, tile_size).clip(self.screen.get_rect())).copy() for corner in corners]
+        self._light_tiles = zip(corners, [self.env.intersections[intersection] for intersection in self.env.locations], tiles[True], tiles[False])
+
+        self.screen = screen
+
+    def rotate_sprite(self, sprite):
+        """ The sprite (drawn facing East) rotated for each heading. """
+
+        return dict((heading, sprite if heading == (1, 0) else self.pygame.transform.rotate(sprite, 180 if heading[0] == -1 else heading[1] * -90))
+                    for heading in self.env.valid_headings)
+
+    def draw_agent(self, location, heading, color, sprites=None):
+        """ Draw a car at 'location' with 'heading', as its sprite if it has one
+            ('sprites' holds the sprite for each heading, see rotate_sprite). """
+
+        # Compute precise agent location here (back from the intersection some)
+        agent_offset = (2 * heading[0] * self.agent_circle_radius + self.agent_circle_radius * heading[1] * 0.5, \
+                        2 * heading[1] * self.agent_circle_radius - self.agent_circle_radius * heading[0] * 0.5)
+
+        agent_pos = (location[0] * self.env.block_size - agent_offset[0], location[1] * self.env.block_size - agent_offset[1])
+        agent_color = self.colors[color]
+
+        if sprites is not None:
+            # Draw agent sprite (image), properly rotated
+            rotated_sprite = sprites[heading]
+            sprite_size = (rotated_sprite.get_width(), rotated_sprite.get_height())
+            self.screen.blit(rotated_sprite,
+                self.pygame.rect.Rect(agent_pos[0] - sprite_size[0] / 2, agent_pos[1] - sprite_size[1] / 2,
+                    sprite_size[0], sprite_size[1]))
+        else:
+            # Draw simple agent (circle with a short line segment poking out to indicate heading)
+            self.pygame.draw.circle(self.screen, agent_color, agent_pos, self.agent_circle_radius)
+            self.pygame.draw.line(self.screen, agent_color, agent_pos, location, self.road_width)
+
     def pause(self):
         """ When the GUI is enabled, this function will pause the simulation. """
         
         abs_pause_time = time.time()
-        self.font = self.pygame.font.Font(None, 30)
+        self.font = self.fonts[30]
         pause_text = "Simulation Paused. Press any key to continue. . ."
         self.screen.blit(self.font.render(pause_text, True, self.colors['red'], self.bg_color), (400, self.height - 30))
         self.pygame.display.flip()
-        print pause_text
+        console.log(RUN, pause_text)
+        console.flush()
         while self.paused:
             for event in self.pygame.event.get():
                 if event.type == self.pygame.KEYDOWN:
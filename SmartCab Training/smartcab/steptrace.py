@@ -0,0 +1,147 @@
+import sys
+import numpy as np
+from environment import Environment
+from simulator import describe_step
+from records import MappedRecordFile, load_records
+from metrics import safety_rating, reliability_rating
+
+# Integer codes of actions, waypoints and sensed traffic (index in Environment.valid_actions)
+action_codes = dict((action, i) for i, action in enumerate(Environment.valid_actions))
+
+# One step of the primary agent
+trace_dtype = np.dtype([
+    ('trial', '<i4'),      # trial number, counted over the whole run
+    ('testing', '?'),
+    ('t', '<i4'),
+    ('state', '<i4'),      # state code from the agent's encoder, -1 if it has none
+    ('waypoint', 'i1'),
+    ('light', '?'),        # True for green
+    ('oncoming', 'i1'),
+    ('left', 'i1'),
+    ('right', 'i1'),
+    ('action', 'i1'),
+    ('reward', '<f8'),
+    ('violation', 'i1'),
+    ('deadline', '<i4'),   # deadline before the step
+    ('success', 'i1')      # trial success as of this step
+])
+
+
+class TraceRecorder(object):
+    """ Appends every step of the primary agent to a memory-mapped record file.
+
+        Attach it to an environment as 'env.trace'; Environment.reset starts a new
+        trial and Environment.act records each step of the primary agent. The file is
+        flushed at the start of every trial (and by the Simulator at the end of one),
+        so after a crash it still holds every finished trial.
+
+        With 'count' set, an existing trace is continued after its first 'count'
+        steps, as when a run resumes from a checkpoint. """
+
+    def __init__(self, filename, encoder=None, chunk_size=65536, count=None):
+        self.file = MappedRecordFile(filename, trace_dtype, chunk_size, count=count)
+        self.encoder = encoder  # encodes agent states, e.g. LearningAgent.encoder
+        self.trial = 0
+        self.testing = False
+
+    def new_trial(self, testing=False):
+        self.flush()  # the record count in the header covers the finished trials
+        self.trial += 1
+        self.testing = testing
+
+    def record(self, t, state, waypoint, inputs, light, action, reward, violation, deadline, success):
+        """ Record one step of the primary agent. """
+
+        self.file.append((
+            self.trial, self.testing, t,
+            self.encoder.encode(state) if self.encoder is not None and state is not None else -1,
+            action_codes[waypoint], light == 'green',
+            action_codes[inputs['oncoming']], action_codes[inputs['left']], action_codes[inputs['right']],
+            action_codes[action], reward, violation, deadline, success
+        ))
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class TraceReplay(object):
+    """ Offline access to the steps recorded by a TraceRecorder, to re-render or
+        re-score trials without simulating them again. """
+
+    def __init__(self, filename, encoder=None, enforce_deadline=True):
+        self.steps = load_records(filename)
+        self.encoder = encoder
+        self.enforce_deadline = enforce_deadline
+
+        # Steps are recorded in trial order, so each trial is a contiguous slice
+        trial = self.steps['trial']
+        self.starts = np.r_[0, np.flatnonzero(trial[1:] != trial[:-1]) + 1] if len(trial) else np.zeros(0, dtype=int)
+        self.ends = np.r_[self.starts[1:], len(trial)]
+        self.trial_ids = np.asarray(trial[self.starts])
+
+    def trials(self):
+        """ The recorded trial numbers. """
+
+        return self.trial_ids
+
+    def trial(self, trial):
+        """ The recorded steps of 'trial'. """
+
+        i = np.searchsorted(self.trial_ids, trial)
+        if i == len(self.trial_ids) or self.trial_ids[i] != trial:
+            raise KeyError("Trial {} was not recorded.".format(trial))
+        return self.steps[self.starts[i]:self.ends[i]]
+
+    def step_data(self, step):
+        """ Rebuild Environment.step_data from a recorded step. """
+
+        actions = Environment.valid_actions
+        return {
+            't': step['t'],
+            'violation': step['violation'],
+            'state': self.encoder.decode(step['state']) if self.encoder is not None and step['state'] >= 0 else None,
+            'deadline': step['deadline'],
+            'waypoint': actions[step['waypoint']],
+            'inputs': {'light': 'green' if step['light'] else 'red', 'oncoming': actions[step['oncoming']],
+                       'left': actions[step['left']], 'right': actions[step['right']]},
+            'light': 'green' if step['light'] else 'red',
+            'action': actions[step['action']],
+            'reward': step['reward']
+        }
+
+    def render(self, trial, out=sys.stdout):
+        """ Write the terminal output of each step of 'trial' to 'out'. """
+
+        for step in self.trial(trial):
+            out.write("\n| Step {} Results\n".format(step['t']))
+            for line in describe_step(self.step_data(step), self.enforce_deadline):
+                out.write(line + "\n")
+
+    def score(self, trial):
+        """ Recompute the trial data of 'trial' (as in Environment.trial_data). """
+
+        steps = self.trial(trial)
+        actions = np.bincount(steps['violation'], minlength=5)
+        return {
+            'testing': bool(steps['testing'][0]),
+            'initial_deadline': int(steps['deadline'][0]),
+            'final_deadline': int(steps['deadline'][-1]) - 1,
+            'net_reward': float(steps['reward'].sum()),
+            'actions': dict((k, int(actions[k])) for k in range(5)),
+            'success': int(steps['success'][-1])
+        }
+
+    def rate(self, testing=True):
+        """ Safety and reliability ratings over the recorded testing (or training) trials. """
+
+        selected = np.flatnonzero(self.steps['testing'][self.starts] == testing)
+        if not len(selected):
+            return None, None
+        lengths = self.ends - self.starts
+        index = np.repeat(np.arange(len(self.starts)), lengths)
+        actions = np.bincount(index * 5 + self.steps['violation'], minlength=5 * len(self.starts)).reshape(-1, 5)
+        success = self.steps['success'][self.ends - 1]
+        return safety_rating(actions[selected], lengths[selected]), reliability_rating(success[selected])
@@ -0,0 +1,152 @@
+import os
+import csv
+import random
+import argparse
+import itertools
+import multiprocessing
+from timeit import default_timer
+import numpy as np
+from environment import Environment
+from simulator import Simulator
+from agent import LearningAgent
+from metrics import safety_rating, reliability_rating
+from output import console, QUIET
+
+# Default search space of the LearningAgent decay schedule
+param_grid = {
+    'epsilon': [0.995],
+    'alpha': [0.25, 0.5],
+    'constant_a': [0.99, 0.995],
+    'tolerance': [0.05, 0.3688]
+}
+param_ranges = {
+    'epsilon': (0.9, 1.0),
+    'alpha': (0.05, 0.9),
+    'constant_a': (0.95, 0.999),
+    'tolerance': (0.01, 0.5)
+}
+
+result_fields = ['epsilon', 'alpha', 'constant_a', 'tolerance', 'seed', 'training_trials', 'training_time',
+                 'testing_trials', 'success_rate', 'safety', 'reliability']
+
+
+class SweepSimulator(Simulator):
+    """ A headless simulator that keeps the metrics of each trial in memory. """
+
+    def __init__(self, env, **kwargs):
+        super(SweepSimulator, self).__init__(env, update_delay=0.0, display=False, log_metrics=False, fast=True, **kwargs)
+        self.trials = []
+        self.training_time = 0.0
+        self.start = default_timer()
+
+    def log_trial(self, trial):
+        """ Keep the metrics of the trial that just finished. """
+
+        data = self.env.trial_data
+        self.trials.append({
+            'testing': data['testing'],
+            'steps': data['initial_deadline'] - data['final_deadline'],
+            'actions': [data['actions'][k] for k in range(5)],
+            'success': data['success']
+        })
+        if not data['testing']:
+            self.training_time = default_timer() - self.start
+
+
+def grid_configs(grid=param_grid):
+    """ Every combination of the parameter values in 'grid'. """
+
+    names = sorted(grid)
+    return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+
+def random_configs(n_samples, ranges=param_ranges, seed=0):
+    """ 'n_samples' parameter sets drawn uniformly from 'ranges'. """
+
+    rng = random.Random(seed)
+    names = sorted(ranges)
+    return [dict((name, rng.uniform(*ranges[name])) for name in names) for _ in xrange(n_samples)]
+
+
+def run_config(config):
+    """ Train and test a LearningAgent with the parameters of 'config' in its own
+        Environment and Simulator, seeded with config['seed']. Returns a result row. """
+
+    random.seed(config['seed'])
+    np.random.seed(config['seed'])
+
+    env = Environment(num_dummies=config.get('num_dummies', 100))
+    agent = env.create_agent(LearningAgent, learning=True, epsilon=config['epsilon'], alpha=config['alpha'],
+                             constant_a=config['constant_a'], tolerance=config['tolerance'])
+    env.set_primary_agent(agent, enforce_deadline=True)
+
+    sim = SweepSimulator(env)
+    sim.run(tolerance=config['tolerance'], n_test=config.get('n_test', 10))
+
+    training = [t for t in sim.trials if not t['testing']]
+    testing = [t for t in sim.trials if t['testing']]
+    result = dict((name, config[name]) for name in result_fields if name in config)
+    result.update({
+        'training_trials': len(training),
+        'training_time': sim.training_time,
+        'testing_trials': len(testing),
+        'success_rate': np.mean([t['success'] for t in testing]) if testing else None,
+        'safety': safety_rating([t['actions'] for t in testing], [t['steps'] for t in testing])[0] if testing else None,
+        'reliability': reliability_rating([t['success'] for t in testing])[0] if testing else None
+    })
+    return result
+
+
+def _silence():
+    """ Turn off the terminal output of the simulations in a worker. """
+
+    console.set_level(QUIET)
+
+
+def sweep(configs, workers=None, seed=0, n_test=10, num_dummies=100, log_filename=None):
+    """ Run every parameter set in 'configs' across a pool of 'workers' processes
+        (default: one per core). Worker i is seeded with 'seed' + i. Returns the
+        result rows in the order of 'configs', and optionally writes them to a CSV. """
+
+    jobs = [dict(config, seed=seed + i, n_test=n_test, num_dummies=num_dummies) for i, config in enumerate(configs)]
+
+    pool = multiprocessing.Pool(workers, initializer=_silence)
+    try:
+        results = pool.map(run_config, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    if log_filename is not None:
+        with open(log_filename, 'wb') as f:
+            writer = csv.DictWriter(f, fieldnames=result_fields)
+            writer.writeheader()
+            writer.writerows(results)
+
+    return results
+
+
+def print_results(results):
+    """ Print the result rows of a sweep as a table. """
+
+    print " ".join("{:>15}".format(name) for name in result_fields)
+    for row in results:
+        print " ".join("{:>15.4f}".format(row[name]) if isinstance(row[name], float) else "{:>15}".format(row[name])
+                       for name in result_fields)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Sweep the LearningAgent decay schedule across a process pool.")
+    parser.add_argument('--samples', type=int, default=None, help="number of random parameter sets (default: the full grid)")
+    parser.add_argument('--workers', type=int, default=None, help="number of worker processes (default: one per core)")
+    parser.add_argument('--seed', type=int, default=0, help="seed of the first worker")
+    parser.add_argument('--n-test', type=int, default=10, help="testing trials per parameter set")
+    parser.add_argument('--num-dummies', type=int, default=100, help="dummy agents in each environment")
+    args = parser.parse_args()
+
+    configs = grid_configs() if args.samples is None else random_configs(args.samples, seed=args.seed)
+    start = default_timer()
+    results = sweep(configs, workers=args.workers, seed=args.seed, n_test=args.n_test, num_dummies=args.num_dummies,
+                    log_filename=os.path.join("logs", "sweep.csv"))
+    print_results(results)
+    print "\n{} parameter sets in {:.2f} seconds.".format(len(results), default_timer() - start)
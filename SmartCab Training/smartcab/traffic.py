@@ -0,0 +1,120 @@
+import numpy as np
+from environment import DummyAgent
+from vecenv import NONE, FORWARD, RIGHT, HEADING_X, HEADING_Y, is_green, summarize_slots, turn
+
+
+class TrafficEngine(object):
+    """ The dummy agents of an Environment, held in NumPy arrays and updated in one pass per step.
+
+        Dummies follow the rules of DummyAgent.update and Environment.act: each one moves
+        to its next waypoint if that is legal given its light and the cars it senses, and
+        then draws a new waypoint. Unlike DummyAgents, which update one after the other,
+        all dummies decide on the positions at the start of the step (as in VecEnvironment).
+        As with DummyAgents, they never sense the primary agent.
+
+        Intersections are indexed by their position in Environment.locations, headings by
+        Environment.valid_headings and waypoints by Environment.valid_actions. A car's
+        slot is 4 * intersection + heading. """
+
+    def __init__(self, env, num_dummies, seed=None):
+        self.env = env
+        self.num_dummies = num_dummies
+        self.columns, self.rows = env.grid_size
+        self.origin = env.bounds[:2]
+        self.heading_index = dict((heading, i) for i, heading in enumerate(env.valid_headings))
+        self.random = np.random.RandomState(seed)
+        self.color_choices = DummyAgent.color_choices
+
+        self.location = self.random.randint(self.columns * self.rows, size=num_dummies)
+        self.heading = np.full(num_dummies, 3, dtype=np.int8)  # South, as in Environment.create_agent
+        self.waypoint = self.random.randint(FORWARD, RIGHT + 1, size=num_dummies).astype(np.int8)
+        self.color = self.random.randint(len(self.color_choices), size=num_dummies).astype(np.int8)
+        self._moved()
+
+    def _moved(self):
+        """ Clear the sensing caches after dummies moved or changed waypoints. """
+
+        self._slots = None  # occupied slots, sorted
+        self._summary = None  # summarize_slots output for each occupied slot
+        self._sensed = {}  # inputs sensed at (location, heading), for Environment.sense
+
+    def place(self, slots):
+        """ Put the dummies on the (distinct) 'slots'. """
+
+        slots = np.asarray(slots, dtype=np.int64)
+        self.location = slots // 4
+        self.heading = (slots % 4).astype(np.int8)
+        self._moved()
+
+    def summary(self):
+        """ The occupied slots and what each of them shows to observers (see vecenv.summarize_slots).
+            Only occupied slots are summarized, so this scales with the dummies, not the grid. """
+
+        if self._summary is None:
+            self._slots, inverse = np.unique(self.location * 4 + self.heading, return_inverse=True)
+            self._summary = summarize_slots(inverse, self.waypoint, len(self._slots))
+        return self._slots, self._summary
+
+    def inputs(self, location, heading):
+        """ The 'oncoming', 'left' and 'right' inputs (action codes) of observers at
+            intersections 'location' facing 'heading', from the dummies. """
+
+        slots, (oncoming, right, left) = self.summary()
+        base = np.asarray(location) * 4
+        heading = np.asarray(heading)
+
+        def lookup(values, slot):
+            if not len(slots):
+                return np.zeros(slot.shape, dtype=np.int8)
+            i = np.minimum(np.searchsorted(slots, slot), len(slots) - 1)
+            return np.where(slots[i] == slot, values[i], NONE)
+
+        return {
+            'oncoming': lookup(oncoming, base + (heading + 2) % 4),
+            'left': lookup(left, base + (heading + 3) % 4),
+            'right': lookup(right, base + (heading + 1) % 4)
+        }
+
+    def sense(self, location, heading):
+        """ What the dummies show an agent at 'location' with 'heading' (Environment coordinates),
+            as the 'oncoming', 'left' and 'right' values of Environment.sense. """
+
+        key = (location, heading)
+        if key not in self._sensed:
+            inputs = self.inputs(self.index(location), self.heading_index[heading])
+            self._sensed[key] = dict((name, self.env.valid_actions[code]) for name, code in inputs.iteritems())
+        return self._sensed[key]
+
+    def index(self, location):
+        """ The intersection index of an (x, y) location. """
+
+        return (location[0] - self.origin[0]) * self.rows + location[1] - self.origin[1]
+
+    def step(self, light_state):
+        """ Update every dummy: move to the next waypoint if it is legal and choose a new one.
+            'light_state' holds the light of each dummy's intersection (True = NS open). """
+
+        inputs = self.inputs(self.location, self.heading)
+        green = is_green(light_state, self.heading)
+        waypoint = self.waypoint
+        okay = np.where(waypoint == RIGHT, green | (inputs['left'] != FORWARD),
+               np.where(waypoint == FORWARD, green,
+                        green & (inputs['oncoming'] != FORWARD) & (inputs['oncoming'] != RIGHT)))
+
+        heading = turn(self.heading, waypoint)
+        x = (self.location // self.rows + HEADING_X[heading] * okay) % self.columns
+        y = (self.location % self.rows + HEADING_Y[heading] * okay) % self.rows
+        self.heading = np.where(okay, heading, self.heading).astype(np.int8)
+        self.location = x * self.rows + y
+        self.waypoint[okay] = self.random.randint(FORWARD, RIGHT + 1, size=okay.sum())
+        self._moved()
+
+    def positions(self):
+        """ (location, heading, color) of each dummy, in Environment terms, for rendering. """
+
+        x = self.location // self.rows + self.origin[0]
+        y = self.location % self.rows + self.origin[1]
+        headings = self.env.valid_headings
+        colors = self.color_choices
+        return [((x, y), headings[h], colors[c]) for x, y, h, c in
+                zip(x.tolist(), y.tolist(), self.heading.tolist(), self.color.tolist())]
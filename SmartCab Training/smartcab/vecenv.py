@@ -0,0 +1,362 @@
+import numpy as np
+from environment import Environment
+
+# Integer codes used by the array-backed worlds
+# Actions (and waypoints) index Environment.valid_actions: None, 'forward', 'left', 'right'
+NONE, FORWARD, LEFT, RIGHT = 0, 1, 2, 3
+# Headings index Environment.valid_headings: E, N, W, S
+HEADING_X = np.array([h[0] for h in Environment.valid_headings], dtype=np.int64)
+HEADING_Y = np.array([h[1] for h in Environment.valid_headings], dtype=np.int64)
+# Base reward for each violation class (0 is resolved against the waypoint separately)
+VIOLATION_REWARD = np.array([0.0, -5.0, -10.0, -20.0, -40.0])
+
+
+def is_green(light_state, heading):
+    """ Whether the light is green for cars with 'heading' (True = NS open). """
+
+    return np.where(light_state, heading % 2 == 1, heading % 2 == 0)
+
+
+def summarize_slots(slot, waypoint, n_slots):
+    """ Summarize the cars in each (intersection, heading) slot the same way that
+        Environment.sense resolves several cars approaching from one side.
+        Cars are taken to be ordered by their position in 'slot'. Returns the
+        'oncoming', 'right' and 'left' input that each slot shows to an observer. """
+
+    last = np.zeros(n_slots, dtype=np.int8)         # waypoint of the last car in the slot
+    first_turn = np.full(n_slots, -1, dtype=np.int8)  # first car heading 'forward' or 'left'
+    has_left = np.zeros(n_slots, dtype=bool)
+    has_forward = np.zeros(n_slots, dtype=bool)
+
+    if len(slot):
+        order = np.argsort(slot, kind='mergesort')  # stable: keeps car order within a slot
+        sorted_slot = slot[order]
+        sorted_waypoint = waypoint[order]
+        ends = np.flatnonzero(np.r_[sorted_slot[1:] != sorted_slot[:-1], True])
+        last[sorted_slot[ends]] = sorted_waypoint[ends]
+
+        turning = (sorted_waypoint == FORWARD) | (sorted_waypoint == LEFT)
+        turning_slot = sorted_slot[turning]
+        if len(turning_slot):
+            starts = np.flatnonzero(np.r_[True, turning_slot[1:] != turning_slot[:-1]])
+            first_turn[turning_slot[starts]] = sorted_waypoint[turning][starts]
+
+        has_left[slot[waypoint == LEFT]] = True
+        has_forward[slot[waypoint == FORWARD]] = True
+
+    oncoming = np.where(has_left, LEFT, last).astype(np.int8)  # 'left' is never overridden
+    right = np.where(first_turn >= 0, first_turn, last).astype(np.int8)  # neither is 'forward' or 'left'
+    left = np.where(has_forward, FORWARD, last).astype(np.int8)  # 'forward' is never overridden
+    return oncoming, right, left
+
+
+def sense_slots(summary, base, heading):
+    """ Look up the 'oncoming', 'left' and 'right' inputs of observers at slot
+        'base' (= 4 * intersection) facing 'heading', given 'summarize_slots' output. """
+
+    oncoming, right, left = summary
+    return {
+        'oncoming': oncoming[base + (heading + 2) % 4],
+        'left': left[base + (heading + 3) % 4],
+        'right': right[base + (heading + 1) % 4]
+    }
+
+
+def judge_actions(action, green, inputs):
+    """ Apply the traffic laws of Environment.act to arrays of actions.
+        Returns the violation code of each action (0 is a legal action). """
+
+    oncoming, left, right = inputs['oncoming'], inputs['left'], inputs['right']
+    cross_traffic = (left == FORWARD) | (right == FORWARD)
+
+    violation = np.zeros(action.shape, dtype=np.int8)
+    violation[(action == FORWARD) & ~green] = 2
+    violation[(action == FORWARD) & ~green & cross_traffic] = 4
+    violation[(action == LEFT) & ~green] = 2
+    violation[(action == LEFT) & ~green & (cross_traffic | (oncoming == RIGHT))] = 4
+    violation[(action == LEFT) & green & ((oncoming == RIGHT) | (oncoming == FORWARD))] = 3
+    violation[(action == RIGHT) & ~green & (left == FORWARD)] = 3
+    violation[(action == NONE) & green & (oncoming != LEFT)] = 1
+    return violation
+
+
+def turn(heading, action):
+    """ The heading after performing 'action' (a no-op for None and 'forward'). """
+
+    return np.where(action == LEFT, (heading + 1) % 4, np.where(action == RIGHT, (heading + 3) % 4, heading))
+
+
+def plan_waypoints(delta_x, delta_y, heading, grid_size):
+    """ Vectorized RoutePlanner.next_waypoint for raw destination deltas
+        (destination - location) on a wrap-around grid of 'grid_size'. """
+
+    delta_x = np.asarray(delta_x)
+    delta_y = np.asarray(delta_y)
+    wrapped_x = np.where(delta_x <= 0, grid_size[0] + delta_x, delta_x - grid_size[0])
+    wrapped_y = np.where(delta_y <= 0, grid_size[1] + delta_y, delta_y - grid_size[1])
+    dx = np.where(np.abs(delta_x) < np.abs(wrapped_x), delta_x, wrapped_x)
+    dy = np.where(np.abs(delta_y) < np.abs(wrapped_y), delta_y, wrapped_y)
+    hx = HEADING_X[heading]
+    hy = HEADING_Y[heading]
+
+    conditions = [
+        (dx == 0) & (dy == 0),
+        # Destination is cardinally East or West of location
+        (dx != 0) & (dx * hx > 0),
+        (dx != 0) & (dx * hx < 0) & (hx < 0) & (dy > 0),
+        (dx != 0) & (dx * hx < 0) & (hx < 0),
+        (dx != 0) & (dx * hx < 0) & (hx > 0) & (dy < 0),
+        (dx != 0) & (dx * hx < 0) & (hx > 0),
+        (dx != 0) & (dx * hy > 0),
+        (dx != 0),
+        # Destination is cardinally North or South of location
+        (dy * hy > 0),
+        (dy * hy < 0) & (hy < 0) & (dx < 0),
+        (dy * hy < 0) & (hy < 0),
+        (dy * hy < 0) & (hy > 0) & (dx > 0),
+        (dy * hy < 0) & (hy > 0),
+        (dy * hx > 0)
+    ]
+    choices = [NONE, FORWARD, LEFT, RIGHT, LEFT, RIGHT, LEFT, RIGHT, FORWARD, LEFT, RIGHT, LEFT, RIGHT, RIGHT]
+    return np.select(conditions, choices, default=LEFT).astype(np.int8)
+
+
+class VecEnvironment(object):
+    """ N independent smartcab worlds held in NumPy arrays and stepped in lockstep.
+
+        Every world follows the rules of Environment: a primary agent, 'num_dummies'
+        dummy agents and a traffic light at each intersection. Intersections are
+        indexed as x * rows + y (the order of Environment.locations), headings
+        index Environment.valid_headings and actions index Environment.valid_actions.
+
+        Unlike Environment, dummy agents move simultaneously: each dummy senses the
+        positions at the start of the step rather than after earlier dummies moved. """
+
+    hard_time_limit = Environment.hard_time_limit
+
+    def __init__(self, n_envs=1, num_dummies=100, grid_size=(8, 6), enforce_deadline=True, seed=None):
+        self.n_envs = n_envs
+        self.num_dummies = num_dummies
+        self.grid_size = grid_size  # (columns, rows)
+        self.bounds = (1, 2, self.grid_size[0], self.grid_size[1] + 1)
+        self.n_intersections = self.grid_size[0] * self.grid_size[1]
+        self.enforce_deadline = enforce_deadline
+        self.random = np.random.RandomState(seed)
+
+        if self.num_dummies > 4 * self.n_intersections:
+            raise ValueError("Cannot place {} dummy agents on {} intersections.".format(self.num_dummies, self.n_intersections))
+
+        N, D, L = self.n_envs, self.num_dummies, self.n_intersections
+
+        # Simulation variables
+        self.t = np.zeros(N, dtype=np.int64)
+        self.done = np.ones(N, dtype=bool)  # worlds start finished until reset
+        self.success = np.zeros(N, dtype=bool)
+
+        # Traffic lights: True = NS open
+        self.light_state = self.random.rand(N, L) < 0.5
+        self.light_period = self.random.randint(2, 6, size=(N, L)).astype(np.int8)
+        self.light_last_updated = np.zeros((N, L), dtype=np.int64)
+
+        # Primary agents
+        self.location = np.zeros(N, dtype=np.int64)
+        self.heading = np.zeros(N, dtype=np.int8)
+        self.destination = np.zeros(N, dtype=np.int64)
+        self.deadline = np.zeros(N, dtype=np.int64)
+
+        # Dummy agents
+        self.dummy_location = np.zeros((N, D), dtype=np.int64)
+        self.dummy_heading = np.full((N, D), 3, dtype=np.int8)  # South, as in Environment.create_agent
+        self.dummy_waypoint = self.random.randint(FORWARD, RIGHT + 1, size=(N, D)).astype(np.int8)
+        self._slot_summary = None  # cached summarize_slots output, cleared when dummies move
+
+        # Trial data (updated at the end of each step)
+        self.trial_data = {
+            'testing': np.zeros(N, dtype=bool),
+            'initial_distance': np.zeros(N, dtype=np.int64),
+            'initial_deadline': np.zeros(N, dtype=np.int64),
+            'net_reward': np.zeros(N),
+            'final_deadline': np.zeros(N, dtype=np.int64),
+            'actions': np.zeros((N, 5), dtype=np.int64),
+            'success': np.zeros(N, dtype=np.int8)
+        }
+
+    def to_location(self, index):
+        """ Convert intersection indices to (x, y) Environment locations. """
+
+        index = np.asarray(index)
+        return np.stack([index // self.grid_size[1] + self.bounds[0], index % self.grid_size[1] + self.bounds[1]], axis=-1)
+
+    def compute_dist(self, a, b):
+        """ Compute the Manhattan (L1) distance of a spherical world between intersection indices. """
+
+        dx1 = np.abs(b // self.grid_size[1] - a // self.grid_size[1])
+        dy1 = np.abs(b % self.grid_size[1] - a % self.grid_size[1])
+        return np.minimum(dx1, self.grid_size[0] - dx1) + np.minimum(dy1, self.grid_size[1] - dy1)
+
+    def reset(self, testing=False, worlds=None):
+        """ Start a new trial in each of 'worlds' (default: every world). """
+
+        if worlds is None:
+            worlds = np.arange(self.n_envs)
+        else:
+            worlds = np.asarray(worlds)
+            if worlds.dtype == bool:
+                worlds = np.flatnonzero(worlds)
+        n, L, D = len(worlds), self.n_intersections, self.num_dummies
+
+        self.done[worlds] = False
+        self.success[worlds] = False
+        self.t[worlds] = 0
+        self.light_last_updated[worlds] = 0
+
+        # Pick a start and a destination that are not too close
+        start = self.random.randint(L, size=n)
+        destination = self.random.randint(L, size=n)
+        close = self.compute_dist(start, destination) < 4
+        while close.any():
+            start[close] = self.random.randint(L, size=close.sum())
+            destination[close] = self.random.randint(L, size=close.sum())
+            close = self.compute_dist(start, destination) < 4
+
+        distance = self.compute_dist(start, destination)
+        self.location[worlds] = start
+        self.heading[worlds] = self.random.randint(4, size=n)
+        self.destination[worlds] = destination
+        self.deadline[worlds] = distance * 5  # 5 time steps per intersection away
+
+        # Place dummies on distinct (intersection, heading) slots
+        if D:
+            slots = np.argpartition(self.random.rand(n, 4 * L), D - 1, axis=1)[:, :D]
+            self.dummy_location[worlds] = slots // 4
+            self.dummy_heading[worlds] = slots % 4
+            self._slot_summary = None
+
+        # Reset metrics for this trial
+        self.trial_data['testing'][worlds] = testing
+        self.trial_data['initial_distance'][worlds] = distance
+        self.trial_data['initial_deadline'][worlds] = distance * 5
+        self.trial_data['final_deadline'][worlds] = distance * 5
+        self.trial_data['net_reward'][worlds] = 0.0
+        self.trial_data['actions'][worlds] = 0
+        self.trial_data['success'][worlds] = 0
+
+    def _summary(self):
+        """ Slot summary of the dummy agents in every world. """
+
+        if self._slot_summary is None:
+            slot = (np.arange(self.n_envs)[:, None] * self.n_intersections + self.dummy_location) * 4 + self.dummy_heading
+            self._slot_summary = summarize_slots(slot.ravel(), self.dummy_waypoint.ravel(), 4 * self.n_envs * self.n_intersections)
+        return self._slot_summary
+
+    def _lights(self, location):
+        """ Light state at 'location' (one intersection index per world, or per dummy). """
+
+        worlds = np.arange(self.n_envs).reshape((-1,) + (1,) * (location.ndim - 1))
+        return self.light_state[worlds, location]
+
+    def waypoints(self):
+        """ The next waypoint of each primary agent (RoutePlanner.next_waypoint). """
+
+        delta_x = self.destination // self.grid_size[1] - self.location // self.grid_size[1]
+        delta_y = self.destination % self.grid_size[1] - self.location % self.grid_size[1]
+        return plan_waypoints(delta_x, delta_y, self.heading, self.grid_size)
+
+    def sense(self):
+        """ Sensor inputs of each primary agent, as Environment.sense. 'light' is
+            True for green; 'oncoming', 'left' and 'right' are action codes. """
+
+        base = (np.arange(self.n_envs) * self.n_intersections + self.location) * 4
+        inputs = sense_slots(self._summary(), base, self.heading)
+        inputs['light'] = is_green(self._lights(self.location), self.heading)
+        return inputs
+
+    def observe(self):
+        """ Everything a primary agent sees at the start of a step: its sensor
+            inputs, its next waypoint and its remaining deadline. """
+
+        observation = self.sense()
+        observation['waypoint'] = self.waypoints()
+        observation['deadline'] = self.deadline.copy()
+        return observation
+
+    def step(self, actions):
+        """ Take one time step in every unfinished world, the primary agents performing
+            'actions' (action codes). Returns the rewards and violation codes. """
+
+        actions = np.asarray(actions, dtype=np.int8)
+        live = ~self.done
+        G = self.grid_size
+
+        # Primary agents act on what they sense at the start of the step
+        summary = self._summary()
+        inputs = self.sense()
+        green = inputs['light']
+        waypoint = self.waypoints()
+        violation = judge_actions(actions, green, inputs)
+        violation[~live] = 0
+
+        # Reward scheme, with a penalty as a function of remaining deadline
+        reward = 2 * self.random.random_sample(self.n_envs) - 1
+        if self.enforce_deadline:
+            fnc = self.t * 1.0 / (self.t + self.deadline)
+            penalty = (np.power(10.0, fnc) - 1) / 9
+        else:
+            penalty = np.zeros(self.n_envs)
+        legal = violation == 0
+        on_route = (actions == waypoint) | ((actions == NONE) & ~green)
+        reward += np.where(legal, np.where(on_route, 2 - penalty, 1 - penalty), VIOLATION_REWARD[violation])
+        reward[~live] = 0.0
+
+        # Move the primary agents
+        move = live & legal & (actions != NONE)
+        heading = turn(self.heading, actions)
+        x = (self.location // G[1] + HEADING_X[heading] * move) % G[0]
+        y = (self.location % G[1] + HEADING_Y[heading] * move) % G[1]
+        self.heading = np.where(move, heading, self.heading).astype(np.int8)
+        self.location = x * G[1] + y
+
+        # Did agents reach the goal?
+        arrived = live & (self.location == self.destination)
+        self.done |= arrived
+        self.success |= arrived
+        self.trial_data['success'][arrived & (self.deadline >= 0)] = 1
+
+        # Update metrics
+        self.trial_data['final_deadline'][live] = self.deadline[live] - 1
+        self.trial_data['net_reward'] += reward
+        np.add.at(self.trial_data['actions'], (np.flatnonzero(live), violation[live]), 1)
+
+        # Update dummy agents: move to the next waypoint if it is legal, and choose a new one
+        dummy_live = np.broadcast_to(live[:, None], self.dummy_location.shape)
+        base = (np.arange(self.n_envs)[:, None] * self.n_intersections + self.dummy_location) * 4
+        dummy_inputs = sense_slots(summary, base, self.dummy_heading)
+        dummy_green = is_green(self._lights(self.dummy_location), self.dummy_heading)
+        waypoint = self.dummy_waypoint
+        okay = np.where(waypoint == RIGHT, dummy_green | (dummy_inputs['left'] != FORWARD),
+               np.where(waypoint == FORWARD, dummy_green,
+                        dummy_green & (dummy_inputs['oncoming'] != FORWARD) & (dummy_inputs['oncoming'] != RIGHT)))
+        okay &= dummy_live
+        heading = turn(self.dummy_heading, waypoint)
+        x = (self.dummy_location // G[1] + HEADING_X[heading] * okay) % G[0]
+        y = (self.dummy_location % G[1] + HEADING_Y[heading] * okay) % G[1]
+        self.dummy_heading = np.where(okay, heading, self.dummy_heading).astype(np.int8)
+        self.dummy_location = x * G[1] + y
+        self.dummy_waypoint[okay] = self.random.randint(FORWARD, RIGHT + 1, size=okay.sum())
+        self._slot_summary = None
+
+        # Update traffic lights
+        switch = live[:, None] & (self.t[:, None] - self.light_last_updated >= self.light_period)
+        self.light_state ^= switch
+        self.light_last_updated = np.where(switch, self.t[:, None], self.light_last_updated)
+
+        # Agents have taken an action: reduce the deadline by 1
+        self.deadline -= live
+        out_of_time = live & (self.deadline <= self.hard_time_limit)
+        if self.enforce_deadline:
+            out_of_time |= live & (self.deadline <= 0)
+        self.done |= out_of_time
+        self.success &= ~out_of_time
+
+        self.t += live
+        return reward, violation
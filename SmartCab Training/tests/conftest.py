@@ -0,0 +1,19 @@
+import os
+import sys
+
+# visuals.py imports the smartcab package; the smartcab modules import each other by name
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+sys.path.insert(0, os.path.join(root, 'smartcab'))
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+import pytest
+
+
+@pytest.fixture
+def workdir(tmpdir, monkeypatch):
+    """ A working directory with the 'logs' folder that the Simulator writes to. """
+
+    tmpdir.mkdir('logs')
+    monkeypatch.chdir(tmpdir)
+    return tmpdir
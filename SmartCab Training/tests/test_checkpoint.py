@@ -0,0 +1,56 @@
+import random
+import numpy as np
+import pytest
+from environment import Environment
+from simulator import Simulator
+from agent import LearningAgent
+
+
+class Crash(Exception):
+    pass
+
+
+class CrashingSimulator(Simulator):
+    """ A Simulator that dies after logging 'crash_after' trials. """
+
+    crash_after = 25
+
+    def log_trial(self, trial):
+        Simulator.log_trial(self, trial)
+        self.logged = getattr(self, 'logged', 0) + 1
+        if self.logged == self.crash_after:
+            raise Crash()
+
+
+def simulate(simulator_class, seed, log_format, **kwargs):
+    """ A short seeded run of a LearningAgent with one learner next to it. """
+
+    random.seed(seed)
+    np.random.seed(seed)
+    env = Environment(num_dummies=20, grid_size=(6, 4))
+    agent = env.create_agent(LearningAgent, learning=True, epsilon=0.995, alpha=0.25, constant_a=0.99)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    env.add_learner(env.create_agent(LearningAgent, learning=True, epsilon=0.995, alpha=0.25, constant_a=0.99, share_Q_with=agent))
+    sim = simulator_class(env, update_delay=0, display=False, log_metrics=True, optimized=True, fast=True,
+                          log_format=log_format, checkpoint_every=10, **kwargs)
+    sim.run(tolerance=0.7, n_test=5)
+
+
+@pytest.mark.parametrize('log_format', ['csv', 'npy'])
+def test_resume_continues_run(workdir, log_format):
+    """ A run that crashes and is resumed from its last checkpoint writes the same
+        logs, Q-table and step trace as a run that never stopped. """
+
+    ext = '.' + log_format
+    logs = ['sim_improved-learning' + ext, 'sim_improved-learning_learners' + ext, 'sim_improved-learning.txt',
+            'sim_improved-learning_Q.npy', 'trace.npy']
+
+    simulate(Simulator, 5, log_format, trace='logs/trace.npy')
+    expected = dict((name, workdir.join('logs', name).read_binary()) for name in logs)
+    assert len(np.load(str(workdir.join('logs', 'trace.npy')))) > 0
+
+    with pytest.raises(Crash):
+        simulate(CrashingSimulator, 5, log_format, trace='logs/trace.npy', checkpoint='logs/checkpoint.npz')
+    simulate(Simulator, 99, log_format, trace='logs/trace.npy', checkpoint='logs/checkpoint.npz', resume=True)
+    for name in logs:
+        assert workdir.join('logs', name).read_binary() == expected[name], name
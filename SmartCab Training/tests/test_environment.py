@@ -0,0 +1,12 @@
+import random
+from environment import Environment
+
+
+def test_step_without_reset():
+    """ Dummy agents drive around an environment that was never reset. """
+
+    random.seed(0)
+    env = Environment(num_dummies=10)
+    for t in range(20):
+        env.step()
+    assert env.t == 20
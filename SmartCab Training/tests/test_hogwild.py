@@ -0,0 +1,63 @@
+import os
+import multiprocessing
+import numpy as np
+import pytest
+from hogwild import train, _next_result
+
+
+def test_train(tmpdir):
+    """ Two workers train one shared Q-table; the trials follow the coordinator's
+        decay schedule, switch to testing, and are all logged. """
+
+    log = str(tmpdir.join('hogwild.npy'))
+    result = train(workers=2, seed=0, constant_a=0.9, tolerance=0.5, min_train=5, n_test=2,
+                   env_kwargs={'num_dummies': 10, 'grid_size': (6, 4)}, log_filename=log, log_format='npy',
+                   Q_filename=str(tmpdir.join('Q.npy')))
+
+    trials = result['trials']
+    training = [data for data in trials if not data['testing']]
+    testing = [data for data in trials if data['testing']]
+    assert len(training) == 7  # until 0.9 ** t < 0.5
+    assert len(testing) == 2
+    assert sorted(data['parameters']['e'] for data in training) == sorted(0.9 ** t for t in range(1, 8))
+    assert all(data['parameters'] == {'e': 0.0, 'a': 0.0} for data in testing)
+    assert all(data['testing'] for data in trials[-2:])  # testing waits for the training trials
+
+    log = np.load(log)
+    assert len(log) == len(trials)
+    assert sorted(log['trial'][~log['testing']]) == range(1, 8)
+    assert result['created'].any()
+    assert np.abs(result['Q'][result['created']]).sum() > 0
+    assert np.array_equal(np.load(str(tmpdir.join('Q.npy')))['Q'], result['Q'])
+    assert result['throughput']['transitions'] > 0
+
+
+def test_train_csv_log(tmpdir):
+    log = tmpdir.join('hogwild.csv')
+    result = train(workers=2, seed=0, constant_a=0.9, tolerance=0.5, min_train=5, n_test=2,
+                   env_kwargs={'num_dummies': 10, 'grid_size': (6, 4)}, log_filename=str(log))
+
+    assert len(log.readlines()) == len(result['trials']) + 1
+
+
+def test_invalid_world():
+    with pytest.raises(ValueError):
+        train(workers=2, env_kwargs={'num_dummies': 100000})
+
+
+def test_failed_worker():
+    """ An error in a worker is raised by the coordinator. """
+
+    with pytest.raises(RuntimeError) as error:
+        train(workers=2, seed=0, agent_kwargs={'no_such_parameter': 1})
+    assert 'TypeError' in str(error.value)
+
+
+def test_dead_worker():
+    """ A worker that dies without a word is noticed rather than waited for. """
+
+    process = multiprocessing.Process(target=os._exit, args=(3,))
+    process.start()
+    process.join()
+    with pytest.raises(RuntimeError):
+        _next_result(multiprocessing.Queue(), [process], timeout=0.1)
@@ -0,0 +1,43 @@
+import random
+import numpy as np
+from environment import TrafficLight, LightBank
+
+
+def test_bank_switches_like_traffic_lights():
+    """ A LightBank and one TrafficLight per intersection, drawn from the same
+        random state, show the same lights at every step of several trials. """
+
+    random.seed(4)
+    bank = LightBank(200)
+    random.seed(4)
+    lights = [TrafficLight() for i in xrange(200)]
+    assert bank.state.tolist() == [light.state for light in lights]
+    assert bank.period.tolist() == [light.period for light in lights]
+
+    for trial, steps in enumerate([300, 17, 120]):
+        bank.reset()
+        for light in lights:
+            light.reset()
+        for t in xrange(steps):
+            bank.update(t)
+            for light in lights:
+                light.update(t)
+            assert bank.state.tolist() == [light.state for light in lights], (trial, t)
+            assert bank.last_updated.tolist() == [light.last_updated for light in lights], (trial, t)
+
+
+def test_loaded_bank_continues():
+    """ A bank loaded mid-trial (as when resuming from a checkpoint) carries on like the original. """
+
+    random.seed(5)
+    bank = LightBank(100)
+    for t in xrange(37):
+        bank.update(t)
+    loaded = LightBank(1)
+    loaded.load(bank.state.copy(), bank.period.copy(), bank.last_updated.copy(), 37)
+
+    for t in xrange(37, 200):
+        bank.update(t)
+        loaded.update(t)
+        assert np.array_equal(loaded.state, bank.state)
+        assert np.array_equal(loaded.last_updated, bank.last_updated)
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from environment import Environment
+from agent import LearningAgent
+from qtable import StateEncoder, save_qtable, load_qtable
+
+
+def trained_agent(env):
+    agent = env.create_agent(LearningAgent, learning=True)
+    random = np.random.RandomState(0)
+    agent.Q[:] = random.randn(*agent.Q.shape)
+    agent.Q_created[:] = random.rand(len(agent.Q_created)) < 0.5
+    return agent
+
+
+def test_encoder_round_trip():
+    encoder = StateEncoder([Environment.valid_actions, ['green', 'red'], Environment.valid_actions])
+
+    assert encoder.n_states == 32
+    for code, state in enumerate(encoder.states):
+        assert encoder.encode(state) == code
+        assert encoder.decode(code) == state
+    assert encoder.encode_indices(encoder.value_indices()).tolist() == range(encoder.n_states)
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_agent_Q_round_trip(tmpdir, mmap):
+    """ An agent warm-started from a saved Q-table has the same action values and created states. """
+
+    env = Environment(num_dummies=0)
+    agent = trained_agent(env)
+    filename = str(tmpdir.join('Q.npy'))
+    agent.save_Q(filename)
+
+    codes, table = load_qtable(filename, agent.encoder, mmap=mmap)
+    assert codes.tolist() == range(agent.encoder.n_states)
+    assert isinstance(table, np.memmap) == mmap
+
+    warm = env.create_agent(LearningAgent, learning=True)
+    warm.load_Q(filename)
+    assert np.array_equal(warm.Q, agent.Q)
+    assert np.array_equal(warm.Q_created, agent.Q_created)
+
+
+def test_load_rows_in_any_order(tmpdir):
+    """ Rows are matched to states by their feature values, not by their position. """
+
+    env = Environment(num_dummies=0)
+    agent = trained_agent(env)
+    filename = str(tmpdir.join('Q.npy'))
+    agent.save_Q(filename)
+    table = np.load(filename)
+    np.save(filename, table[::-1])
+
+    warm = env.create_agent(LearningAgent, learning=True)
+    warm.load_Q(filename)
+    assert np.array_equal(warm.Q, agent.Q)
+    assert np.array_equal(warm.Q_created, agent.Q_created)
+
+
+def test_load_rejects_other_states(tmpdir):
+    encoder = StateEncoder([Environment.valid_actions, ['green', 'red']])
+    filename = str(tmpdir.join('Q.npy'))
+    save_qtable(filename, encoder, np.zeros((encoder.n_states, 4)), np.zeros(encoder.n_states, dtype=bool))
+
+    agent = LearningAgent(Environment(num_dummies=0), learning=True)
+    with pytest.raises(ValueError):
+        agent.load_Q(filename)
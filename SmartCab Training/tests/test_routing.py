@@ -0,0 +1,42 @@
+import random
+import pytest
+from environment import Environment
+from agent import LearningAgent
+from planner import RoutePlanner
+from routing import RoutingTable
+
+
+@pytest.mark.parametrize('grid_size', [(8, 6), (5, 4), (4, 7)])
+def test_table_matches_planner(grid_size):
+    """ The table gives the waypoint of RoutePlanner and the distance of
+        Environment.compute_dist for every location, heading and destination. """
+
+    env = Environment(num_dummies=0, grid_size=grid_size)
+    agent = env.create_agent(LearningAgent, learning=False)
+    planner = RoutePlanner(env, agent)
+    table = RoutingTable(env.grid_size, env.bounds, env.valid_actions, env.valid_headings)
+
+    locations = env.intersections.keys()
+    for location in locations:
+        for destination in locations:
+            assert table.distance(location, destination) == env.compute_dist(location, destination)
+            planner.route_to(destination)
+            for heading in env.valid_headings:
+                env.agent_states[agent] = {'location': location, 'heading': heading}
+                assert table.waypoint(location, heading, destination) == planner.next_waypoint()
+
+
+def test_trips_are_far_enough():
+    random.seed(0)
+    env = Environment(num_dummies=0, grid_size=(5, 4), routing_table=True)
+    for i in range(200):
+        start, destination = env.routes.sample_trip()
+        assert start in env.intersections and destination in env.intersections
+        assert env.compute_dist(start, destination) >= 4
+
+
+def test_tiny_grid():
+    """ A grid without trips of the minimum distance is rejected, rather than sampled forever. """
+
+    with pytest.raises(ValueError):
+        Environment(num_dummies=0, grid_size=(2, 2), routing_table=True)
@@ -0,0 +1,56 @@
+import random
+from environment import Environment
+from agent import LearningAgent
+
+
+def scan_inputs(env, agent):
+    """ The 'oncoming', 'left' and 'right' inputs of 'agent', found by scanning
+        every agent in the environment (Environment.sense before the occupancy index). """
+
+    state = env.agent_states[agent]
+    location = state['location']
+    heading = state['heading']
+    oncoming = None
+    left = None
+    right = None
+    for other_agent, other_state in env.agent_states.iteritems():
+        if agent == other_agent or location != other_state['location'] or (heading[0] == other_state['heading'][0] and heading[1] == other_state['heading'][1]):
+            continue
+        if other_agent == env.primary_agent:
+            continue
+        other_heading = other_agent.get_next_waypoint()
+        if (heading[0] * other_state['heading'][0] + heading[1] * other_state['heading'][1]) == -1:
+            if oncoming != 'left':
+                oncoming = other_heading
+        elif (heading[1] == other_state['heading'][0] and -heading[0] == other_state['heading'][1]):
+            if right != 'forward' and right != 'left':
+                right = other_heading
+        else:
+            if left != 'forward':
+                left = other_heading
+    return {'oncoming': oncoming, 'left': left, 'right': right}
+
+
+def test_sense_matches_full_scan():
+    """ The occupancy index gives every agent the same inputs as a scan of all agents,
+        on a crowded grid where several cars often wait at one intersection. """
+
+    random.seed(1)
+    env = Environment(num_dummies=80, grid_size=(6, 4))
+    agent = env.create_agent(LearningAgent, learning=False)
+    env.set_primary_agent(agent, enforce_deadline=False)
+
+    calls = 0
+    crowded = 0
+    for trial in range(3):
+        env.reset()
+        for t in range(40):
+            for other_agent in env.agent_states:
+                inputs = env.sense(other_agent)
+                expected = scan_inputs(env, other_agent)
+                assert dict((side, inputs[side]) for side in expected) == expected
+                calls += 1
+                crowded += sum(value is not None for value in expected.values()) > 1
+            env.step()
+    assert calls > 9000
+    assert crowded > 100
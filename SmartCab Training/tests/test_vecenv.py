@@ -0,0 +1,74 @@
+import random
+import numpy as np
+import pytest
+from environment import Environment
+from agent import LearningAgent
+from vecenv import VecEnvironment
+
+actions = Environment.valid_actions
+
+
+def load_world(env, vec):
+    """ Copy the primary agent, the dummies and the lights of 'env' into world 0 of 'vec'. """
+
+    index = env.intersections
+    headings = Environment.valid_headings
+    state = env.agent_states[env.primary_agent]
+    vec.location[0] = index[state['location']]
+    vec.heading[0] = headings.index(state['heading'])
+    vec.destination[0] = index[state['destination']]
+    vec.deadline[0] = state['deadline']
+    vec.t[0] = env.t
+    vec.done[0] = False
+    vec.light_state[0] = env.lights.state
+
+    if env.traffic is not None:
+        vec.dummy_location[0] = env.traffic.location
+        vec.dummy_heading[0] = env.traffic.heading
+        vec.dummy_waypoint[0] = env.traffic.waypoint
+    else:
+        dummies = [agent for agent in env.agent_states if agent is not env.primary_agent]  # in creation order
+        vec.dummy_location[0] = [index[env.agent_states[agent]['location']] for agent in dummies]
+        vec.dummy_heading[0] = [headings.index(env.agent_states[agent]['heading']) for agent in dummies]
+        vec.dummy_waypoint[0] = [actions.index(agent.get_next_waypoint()) for agent in dummies]
+    vec._slot_summary = None
+
+
+@pytest.mark.parametrize('traffic_engine', [False, True])
+def test_steps_match_environment(traffic_engine):
+    """ At every step of a few trials, a VecEnvironment loaded with the state of an
+        Environment senses the same inputs and waypoint, judges the primary agent's
+        action the same, and moves the agent to the same place. """
+
+    random.seed(3)
+    np.random.seed(3)
+    env = Environment(num_dummies=60, grid_size=(6, 4), traffic_engine=traffic_engine)
+    agent = env.create_agent(LearningAgent, learning=False)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    vec = VecEnvironment(n_envs=1, num_dummies=60, grid_size=(6, 4), seed=3)
+
+    steps = 0
+    for trial in range(5):
+        env.reset()
+        while not env.done:
+            load_world(env, vec)
+            observation = vec.observe()
+            env.step()
+            data = env.step_data
+            action = np.array([actions.index(data['action'])], dtype=np.int8)
+            before = vec.trial_data['actions'][0].copy()
+            vec.step(action)
+            violation = np.flatnonzero(vec.trial_data['actions'][0] - before)
+            steps += 1
+
+            assert observation['light'][0] == (data['light'] == 'green')
+            for side in ['oncoming', 'left', 'right']:
+                assert actions[observation[side][0]] == data['inputs'][side]
+            assert actions[observation['waypoint'][0]] == data['waypoint']
+            assert violation.tolist() == [data['violation']]
+
+            state = env.agent_states[agent]
+            assert vec.to_location(vec.location)[0].tolist() == list(state['location'])
+            assert Environment.valid_headings[vec.heading[0]] == state['heading']
+            assert vec.deadline[0] == state['deadline']
+    assert steps > 50
@@ -0,0 +1,59 @@
+import random
+import numpy as np
+import pytest
+from environment import Environment
+from simulator import Simulator
+from agent import LearningAgent
+import visuals
+
+
+def simulate(log_format, profile=False):
+    """ A short seeded run of a LearningAgent with one learner next to it. """
+
+    random.seed(7)
+    np.random.seed(7)
+    env = Environment(num_dummies=20, grid_size=(6, 4))
+    agent = env.create_agent(LearningAgent, learning=True, epsilon=0.995, alpha=0.25, constant_a=0.95)
+    env.set_primary_agent(agent, enforce_deadline=True)
+    env.add_learner(env.create_agent(LearningAgent, learning=True, epsilon=0.995, alpha=0.25, constant_a=0.95, share_Q_with=agent))
+    sim = Simulator(env, update_delay=0, display=False, log_metrics=True, optimized=True, fast=True,
+                    log_format=log_format, profile=profile)
+    sim.run(tolerance=0.5, n_test=5)
+
+
+def assert_same_trials(csv_data, npy_data):
+    """ The columns of a .npy log hold the values of the same columns of a csv log. """
+
+    assert len(npy_data) == len(csv_data) > 20
+    for column in npy_data.columns:
+        if column.startswith('profile_'):
+            continue
+        assert np.allclose(npy_data[column].values.astype(float), csv_data[column].values.astype(float)), column
+
+
+@pytest.mark.parametrize('log', ['sim_improved-learning', 'sim_improved-learning_learners'])
+def test_npy_log_loads_like_csv(workdir, log):
+    """ load_trials reads the same trials from a .npy log as from a csv log. """
+
+    simulate('csv')
+    csv_data = visuals.load_trials('logs/' + log + '.csv')
+    simulate('npy')
+    npy_data = visuals.load_trials('logs/' + log + '.npy')
+
+    assert 'profile_update' not in npy_data.columns
+    assert_same_trials(csv_data, npy_data)
+
+
+def test_profiled_npy_log_loads(workdir):
+    """ A profiled .npy log loads with one column per profiled phase, and plots. """
+
+    simulate('csv')
+    csv_data = visuals.load_trials('logs/sim_improved-learning.csv')
+    simulate('npy', profile=True)
+    npy_data = visuals.load_trials('logs/sim_improved-learning.npy')
+
+    profile = [column for column in npy_data.columns if column.startswith('profile_')]
+    assert profile
+    assert (npy_data[profile].values >= 0).all()
+    assert_same_trials(csv_data, npy_data)
+    visuals.plot_trials('sim_improved-learning.npy')
@@ -5,87 +5,74 @@ import warnings
 warnings.filterwarnings("ignore", category = UserWarning, module = "matplotlib")
 ###########################################
 #
-# Display inline matplotlib plots with IPython
+# Display inline matplotlib plots with IPython (when run in IPython)
 from IPython import get_ipython
-get_ipython().run_line_magic('matplotlib', 'inline')
+if get_ipython() is not None:
+    get_ipython().run_line_magic('matplotlib', 'inline')
 ###########################################
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 import os
-import ast
+from smartcab.metrics import safety_rating, reliability_rating, parse_actions, parse_parameter, trial_metrics, rolling_columns
+from smartcab.records import load_records
+
+# Columns of 'data' holding the count of each action class in a trial
+action_columns = ['good_actions', 'minor_actions', 'major_actions', 'minor_acc_actions', 'major_acc_actions']
 
 
 def calculate_safety(data):
 	""" Calculates the safety rating of the smartcab during testing. """
 
-	good_ratio = data['good_actions'].sum() * 1.0 / \
-	(data['initial_deadline'] - data['final_deadline']).sum()
-
-	if good_ratio == 1: # Perfect driving
-		return ("A+", "green")
-	else: # Imperfect driving
-		if data['actions'].apply(lambda x: ast.literal_eval(x)[4]).sum() > 0: # Major accident
-			return ("F", "red")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[3]).sum() > 0: # Minor accident
-			return ("D", "#EEC700")
-		elif data['actions'].apply(lambda x: ast.literal_eval(x)[2]).sum() > 0: # Major violation
-			return ("C", "#EEC700")
-		else: # Minor violation
-			minor = data['actions'].apply(lambda x: ast.literal_eval(x)[1]).sum()
-			if minor >= len(testing_data)/2: # Minor violation in at least half of the trials
-				return ("B", "green")
-			else:
-				return ("A", "green")
+	if all(column in data for column in action_columns):
+		actions = data[action_columns].values
+	else:
+		actions = parse_actions(data['actions'])
+	return safety_rating(actions, data['initial_deadline'] - data['final_deadline'])
 
 
 def calculate_reliability(data):
 	""" Calculates the reliability rating of the smartcab during testing. """
 
-	success_ratio = data['success'].sum() * 1.0 / len(data)
+	return reliability_rating(data['success'])
+
 
-	if success_ratio == 1: # Always meets deadline
-		return ("A+", "green")
+def load_trials(filename):
+	""" Loads a trial log written by the simulation, as CSV or as typed .npy records. """
+
+	if filename.endswith('.npy'):
+		records = load_records(filename)
+		data = pd.DataFrame(dict((name, records[name]) for name in records.dtype.names if name != 'actions'),
+			columns=[name for name in records.dtype.names if name != 'actions'])
+		actions = records['actions']
 	else:
-		if success_ratio >= 0.90:
-			return ("A", "green")
-		elif success_ratio >= 0.80:
-			return ("B", "green")
-		elif success_ratio >= 0.70:
-			return ("C", "#EEC700")
-		elif success_ratio >= 0.60:
-			return ("D", "#EEC700")
-		else:
-			return ("F", "red")
+		data = pd.read_csv(filename)
+		actions = parse_actions(data['actions'])
+		data['epsilon'] = parse_parameter(data['parameters'], 'e')
+		data['alpha'] = parse_parameter(data['parameters'], 'a')
+
+	for k, column in enumerate(action_columns):
+		data[column] = actions[:, k]
+	return data
 
 
 def plot_trials(csv):
 	""" Plots the data from logged metrics during a simulation."""
 
-	data = pd.read_csv(os.path.join("logs", csv))
+	data = load_trials(os.path.join("logs", csv))
 
 	if len(data) < 10:
 		print "Not enough data collected to create a visualization."
 		print "At least 20 trials are required."
 		return
 	
-	# Create additional features
-	data['average_reward'] = pd.rolling_mean(data['net_reward'] / (data['initial_deadline'] - data['final_deadline']), 10)
-	data['reliability_rate'] = pd.rolling_mean(data['success']*100, 10)  # compute avg. net reward with window=10
-	data['good_actions'] = data['actions'].apply(lambda x: ast.literal_eval(x)[0])
-	data['good'] = pd.rolling_mean(data['good_actions'] * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline']), 10)
-	data['minor'] = pd.rolling_mean(data['actions'].apply(lambda x: ast.literal_eval(x)[1]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline']), 10)
-	data['major'] = pd.rolling_mean(data['actions'].apply(lambda x: ast.literal_eval(x)[2]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline']), 10)
-	data['minor_acc'] = pd.rolling_mean(data['actions'].apply(lambda x: ast.literal_eval(x)[3]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline']), 10)
-	data['major_acc'] = pd.rolling_mean(data['actions'].apply(lambda x: ast.literal_eval(x)[4]) * 1.0 / \
-		(data['initial_deadline'] - data['final_deadline']), 10)
-	data['epsilon'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['e']) 
-	data['alpha'] = data['parameters'].apply(lambda x: ast.literal_eval(x)['a']) 
+	# Create additional features: 10-trial rolling averages of reward per action,
+	# reliability rate and the relative frequency of each action class
+	rolling = trial_metrics(data[action_columns].values, data['initial_deadline'] - data['final_deadline'],
+		data['net_reward'], data['success'])
+	for k, column in enumerate(rolling_columns):
+		data[column] = rolling[:, k]
 
 
 	# Create training and testing subsets
@@ -119,7 +106,7 @@ def plot_trials(csv):
 	ax = plt.subplot2grid((6,6), (2,3), colspan=3, rowspan=2)
 
 	# Check whether the agent was expected to learn
-	if csv != 'sim_no-learning.csv':
+	if not csv.startswith('sim_no-learning'):
 		ax.set_ylabel("Parameter Value")
 		ax.set_xlabel("Trial Number")
 		ax.set_xlim((1, len(training_data)))